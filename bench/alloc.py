@@ -0,0 +1,92 @@
+# Checks that animations don't allocate while they run. Needs gc.mem_alloc, so it runs on the
+# MicroPython unix port and nothing else, and only uses what that port has (no os.path,
+# argparse, tempfile, ...):
+#   micropython bench/alloc.py
+# Every effect runs a full Animations._render through a compositor layer (flushed by its run()
+# task) and a NullDriver output, first recording into the frame cache and then replaying from it, with the GC off.
+# The heap has to be the same at the last frame as at the first.
+
+import asyncio
+import gc
+import sys
+from array import array
+
+if not hasattr(gc, "mem_alloc"):
+    print("gc.mem_alloc not available, run this on the MicroPython unix port")
+    sys.exit(2)
+
+# repo root, the script's own directory is already on the path
+sys.path.insert(0, (__file__.rpartition("/")[0] or ".") + "/..")
+
+from lib.animations import Animations, FRAME_MS  # noqa: E402
+from lib.compositor import Compositor  # noqa: E402
+from lib.framecache import FrameCache  # noqa: E402
+from lib.metrics import metrics  # noqa: E402
+from lib.output import ChannelOutput, NullDriver  # noqa: E402
+from lib.state import ANIMATE_IN, ANIMATE_OUT, AnimationConfig, AnimationState, ChannelBuffer  # noqa: E402
+
+# one PCA9685 board plus a PWM channel, like the default channel map
+CHANNELS = 17
+
+# effect, phase, easing, as combined in main.all_animations
+EFFECTS = (
+    ("wave_in", ANIMATE_IN, "quad_out"),
+    ("wave_out", ANIMATE_OUT, "quad_in"),
+    ("breathe_in", ANIMATE_IN, "sine_out"),
+    ("breathe_out", ANIMATE_OUT, "sine_in_out"),
+)
+
+
+async def check():
+    animation = AnimationConfig()
+    animation.duration = 1
+    state = AnimationState()
+    output = ChannelOutput([NullDriver(CHANNELS)], array("H", range(4096)))
+    channels = ChannelBuffer(output.values)
+    channels.update_low(animation.level_min, animation.edge_glow)
+    compositor = Compositor(output, channels.low, 1)
+    animations = Animations(animation, state, channels, compositor.layers[0], FrameCache())
+
+    # gc.mem_alloc() at the first and the last frame of a run
+    heap = array("i", [-1, 0])
+    commit = animations.commit
+
+    def measured_commit():
+        commit()
+        if heap[0] < 0:
+            heap[0] = gc.mem_alloc()
+        heap[1] = gc.mem_alloc()
+
+    animations.commit = measured_commit
+    flush = asyncio.create_task(compositor.run(FRAME_MS))
+
+    failed = False
+    for run in ("record", "replay"):
+        for name, phase, easing in EFFECTS:
+            compositor.activate(0)
+            state.phase = phase
+            heap[0] = -1
+            gc.collect()
+            gc.disable()
+            try:
+                await getattr(animations, name)(easing)
+            finally:
+                gc.enable()
+            if phase == ANIMATE_OUT:
+                compositor.release(0)
+            allocated = heap[1] - heap[0]
+            print("%-12s %-7s %6d bytes" % (name, run, allocated))
+            failed = failed or allocated != 0
+    flush.cancel()
+    print("frame cache hits:", metrics.counters["frame_cache_hits"])
+    return not failed
+
+
+def main():
+    if not asyncio.run(check()):
+        print("animations allocate while running")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Stand-in MQTT 3.1.1 broker for the host benchmarks: QoS 0, exact topic matches,
+# retained messages. Just enough to exercise lib/mqtt.py and Hass.
+
+import asyncio
+import struct
+
+
+class Broker:
+    def __init__(self):
+        self.subscriptions = {}
+        self.retained = {}
+        self.publishes = 0
+        self._server = None
+        self.port = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._client, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self._server.close()
+
+    async def _read_packet(self, reader):
+        ptype = (await reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            digit = (await reader.readexactly(1))[0]
+            length |= (digit & 0x7F) << shift
+            shift += 7
+            if not digit & 0x80:
+                break
+        return ptype, await reader.readexactly(length) if length else b""
+
+    def _packet(self, ptype, body):
+        header = bytearray([ptype])
+        length = len(body)
+        while True:
+            digit = length & 0x7F
+            length >>= 7
+            header.append(digit | 0x80 if length else digit)
+            if not length:
+                break
+        return bytes(header) + body
+
+    def _publish(self, topic, msg):
+        body = struct.pack("!H", len(topic)) + topic + msg
+        for writer in self.subscriptions.get(topic, ()):
+            writer.write(self._packet(0x30, body))
+
+    async def _client(self, reader, writer):
+        topics = []
+        try:
+            ptype, _ = await self._read_packet(reader)
+            if ptype != 0x10:
+                return
+            writer.write(b"\x20\x02\x00\x00")
+            while True:
+                ptype, body = await self._read_packet(reader)
+                kind = ptype & 0xF0
+                if kind == 0x30:
+                    self.publishes += 1
+                    topic_len = struct.unpack("!H", body[:2])[0]
+                    topic = body[2 : 2 + topic_len]
+                    msg = body[2 + topic_len :]
+                    if ptype & 0x01:
+                        self.retained[topic] = msg
+                    self._publish(topic, msg)
+                elif kind == 0x80:
+                    pos = 2
+                    granted = b""
+                    while pos < len(body):
+                        topic_len = struct.unpack("!H", body[pos : pos + 2])[0]
+                        topic = body[pos + 2 : pos + 2 + topic_len]
+                        pos += 3 + topic_len
+                        topics.append(topic)
+                        self.subscriptions.setdefault(topic, []).append(writer)
+                        granted += b"\x00"
+                    writer.write(self._packet(0x90, body[:2] + granted))
+                    for topic in topics:
+                        if topic in self.retained:
+                            self._publish(topic, self.retained[topic])
+                elif kind == 0xC0:
+                    writer.write(b"\xd0\x00")
+                elif kind == 0xE0:
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            for topic in topics:
+                self.subscriptions[topic].remove(writer)
+            writer.close()
@@ -0,0 +1,63 @@
+# Makes CPython look enough like MicroPython to run the firmware modules on the host:
+# the stand-ins in bench/fakes (machine, network, u*) go first on sys.path and time/asyncio
+# get the MicroPython-only helpers. Modules that already have them (unix port) are left alone.
+
+import asyncio
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+FAKES_DIR = os.path.join(BENCH_DIR, "fakes")
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+# seconds, swapped for a virtual clock by the simulator
+_now = time.monotonic
+
+
+def set_clock(now):
+    global _now
+    _now = now
+
+
+def install():
+    try:
+        import warnings
+
+        # lib/primitives/init.py creates a coroutine just to get its type
+        warnings.filterwarnings("ignore", message="coroutine '_g' was never awaited")
+    except ImportError:
+        pass
+
+    for path in (FAKES_DIR, ROOT_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    if not hasattr(time, "ticks_ms"):
+        time.ticks_ms = lambda: int(_now() * 1000)
+        time.ticks_us = lambda: int(_now() * 1000000)
+        time.ticks_add = lambda ticks, delta: ticks + delta
+        time.ticks_diff = lambda end, start: end - start
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+        time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+    if not hasattr(asyncio, "sleep_ms"):
+        asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+        asyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+        asyncio.ThreadSafeFlag = ThreadSafeFlag
@@ -0,0 +1,110 @@
+# Recording stand-in for the MicroPython machine module
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=None, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        # pulled up inputs idle high
+        self._value = 1 if pull == Pin.PULL_UP else 0 if value is None else value
+        self._handler = None
+        self._trigger = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, handler=None, trigger=0):
+        self._handler = handler
+        self._trigger = trigger
+
+    # host side: drive the pin level and fire the irq like the hardware would
+    def drive(self, value):
+        if value == self._value:
+            return
+        self._value = value
+        edge = Pin.IRQ_RISING if value else Pin.IRQ_FALLING
+        if self._handler is not None and self._trigger & edge:
+            self._handler(self)
+
+
+# PCA9685 ALL_CALL, written registers land on every board with MODE1 ALLCALL set
+ALL_CALL_ADDRESS = 0x70
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400000):
+        self.id = id
+        self.freq = freq
+        # address -> register file, auto-incrementing writes like the PCA9685
+        self.registers = {}
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def _regs(self, addr):
+        regs = self.registers.get(addr)
+        if regs is None:
+            regs = self.registers[addr] = bytearray(256)
+        return regs
+
+    def writeto_mem(self, addr, memaddr, buf):
+        if addr == ALL_CALL_ADDRESS:
+            targets = [regs for regs in self.registers.values() if regs[0] & 0x01]
+        else:
+            targets = [self._regs(addr)]
+        for regs in targets:
+            for i, b in enumerate(bytes(buf)):
+                regs[(memaddr + i) & 0xFF] = b
+            # PCA9685 ALL_LED_ON_L..ALL_LED_OFF_H, shows up in every LEDn register
+            if memaddr == 0xFA:
+                for led in range(16):
+                    regs[0x06 + 4 * led : 0x0A + 4 * led] = bytes(buf)
+        self.transactions += 1
+        self.bytes_written += len(buf)
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        regs = self._regs(addr)
+        self.transactions += 1
+        self.bytes_read += nbytes
+        return bytes(regs[(memaddr + i) & 0xFF] for i in range(nbytes))
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+
+class PWM:
+    def __init__(self, pin, freq=0, duty=0):
+        self.pin = pin
+        self.freq = freq
+        self._duty_u16 = duty * 64
+        self.writes = 0
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty_u16
+        self._duty_u16 = value
+        self.writes += 1
+
+    def duty(self, value=None):
+        if value is None:
+            return self._duty_u16 >> 6
+        self.duty_u16(value << 6)
@@ -0,0 +1,64 @@
+# Stand-in for the MicroPython network module, joins instantly unless the requested
+# BSSID isn't in the (host adjustable) list of access points
+
+STA_IF = 0
+AP_IF = 1
+
+# (ssid, bssid, channel, RSSI, security, hidden) as returned by scan()
+access_points = [
+    (b"bench", b"\x02\x00\x00\x00\x00\x01", 6, -60, 3, False),
+    (b"bench", b"\x02\x00\x00\x00\x00\x02", 11, -48, 3, False),
+]
+
+
+class WLAN:
+    _instances = {}
+
+    def __new__(cls, interface=STA_IF):
+        # like the firmware, every WLAN(STA_IF) is the same interface
+        wlan = cls._instances.get(interface)
+        if wlan is None:
+            wlan = cls._instances[interface] = super().__new__(cls)
+            wlan.interface = interface
+            wlan._active = False
+            wlan._connected = False
+            wlan._ifconfig = ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+            wlan._config = {"channel": 1}
+            wlan.scans = 0
+            wlan.joins = []
+        return wlan
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = value
+        if not value:
+            self._connected = False
+
+    def connect(self, ssid=None, key=None, bssid=None):
+        self.joins.append(bssid)
+        if bssid is not None and not any(ap[1] == bssid for ap in access_points):
+            return
+        self._connected = self._active
+        if self._ifconfig[0] == "0.0.0.0":
+            self._ifconfig = ("192.168.0.50", "255.255.255.0", "192.168.0.1", "192.168.0.1")
+
+    def scan(self):
+        self.scans += 1
+        return list(access_points)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self):
+        return self._connected
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        self._ifconfig = config
@@ -0,0 +1 @@
+from json import *  # noqa: F401,F403
@@ -0,0 +1,56 @@
+# Lists the imports main.py and lib/ do before the first frame and fails if a module that's
+# meant to load after it (asyncio, gc, network, MQTT, Hass, ...) shows up:
+#   python bench/imports.py
+
+import builtins
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compat  # noqa: E402
+
+compat.install()
+
+import run  # noqa: E402
+
+# loaded after boot to light, see the staged boot in main.py
+LATE = ("asyncio", "uasyncio", "gc", "network", "lib.animations", "lib.trigger", "lib.mqtt", "lib.hass", "lib.wifi")
+
+
+def main():
+    imports = []
+    first_frame = []
+    real_import = builtins.__import__
+    real_print = builtins.print
+
+    def traced_import(name, globals=None, locals=None, fromlist=(), level=0):
+        caller = (globals or {}).get("__name__", "")
+        if not first_frame and (caller == "main" or caller.startswith("lib")):
+            imports.append((name, caller))
+        return real_import(name, globals, locals, fromlist, level)
+
+    def traced_print(*args, **kwargs):
+        if args and args[0] == "Boot to light:":
+            first_frame.append(True)
+        real_print(*args, **kwargs)
+
+    builtins.__import__ = traced_import
+    builtins.print = traced_print
+    try:
+        run.load_main(0)
+    finally:
+        builtins.__import__ = real_import
+        builtins.print = real_print
+
+    print("imported before the first frame:")
+    for name, caller in sorted(set(imports)):
+        print("  %-16s from %s" % (name, caller))
+    late = sorted(set(name for name, _ in imports if name in LATE))
+    if late:
+        print("loaded too early:", ", ".join(late))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+# Host benchmarks for the firmware, CPython only (frame allocations are checked on the
+# MicroPython unix port by bench/alloc.py):
+#   python bench/run.py [--duration 1] [--commands 50] [--boards 1] [--output pca9685]
+#                       [--json results.json]
+# Every entry of all_animations is played against the recording I2C/PWM fakes and Hass
+# is driven through a stand-in broker. Results are printed and optionally written as JSON
+# so regressions can be tracked between runs.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compat  # noqa: E402
+
+compat.install()
+
+from broker import Broker  # noqa: E402
+from lib.state import IDLE, ANIMATE_IN, ANIMATE_OUT  # noqa: E402
+
+
+def load_main(port, boards=1, output="pca9685"):
+    # main.py reads config.json from the working directory at import
+    workdir = tempfile.mkdtemp(prefix="stairs-bench-")
+    config = {
+        "broker": "127.0.0.1",
+        "port": port,
+        "client_id": "stairs-bench",
+        "username": "bench",
+        "password": "bench",
+        "ssid": "bench",
+        "ssid_password": "bench",
+    }
+    if output != "pca9685":
+        # same channel count without the bus, null for effect cost only
+        config["outputs"] = [{"type": output, "channels": 16 * boards + 1}]
+    elif boards != 1:
+        # PCA9685 boards at 0x40.. plus the PWM pin, like a longer staircase
+        config["outputs"] = [{"type": "pca9685", "address": 0x40 + n} for n in range(boards)]
+        config["outputs"].append({"type": "pwm", "pin": 12})
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump(config, f)
+    os.chdir(workdir)
+    import main
+
+    return main
+
+
+def pwm_writes(output):
+    from lib.output import PWMDriver
+
+    return sum(driver.pwm.writes for driver in output.drivers if isinstance(driver, PWMDriver))
+
+
+async def bench_effect(main, effect, phase, frames):
+    i2c = main.i2c
+    output = main.output
+    i2c.reset_counters()
+    pwm_start = pwm_writes(output)
+    issued = output.writes_issued()
+    skipped = output.writes_skipped
+    frames[0] = 0
+
+    main.layer_states[main.TRIGGER2_LAYER].phase = phase
+    start = time.ticks_ms()
+    await effect()
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+
+    return {
+        "duration_ms": elapsed,
+        "configured_ms": main.animation.duration * 1000,
+        "frames": frames[0],
+        "fps": round(frames[0] * 1000 / elapsed, 1) if elapsed else 0,
+        "i2c_transactions": i2c.transactions,
+        "i2c_bytes": i2c.bytes_written + i2c.bytes_read,
+        "pwm_writes": pwm_writes(output) - pwm_start,
+        "writes_issued": output.writes_issued() - issued,
+        "writes_skipped": output.writes_skipped - skipped,
+    }
+
+
+async def bench_animations(main):
+    # effects play on the trigger 2 layer, count committed frames
+    layer = main.TRIGGER2_LAYER
+    animations = main.layer_animations[layer]
+    frames = [0]
+    commit = animations.commit
+
+    def counting_commit():
+        frames[0] += 1
+        commit()
+
+    animations.commit = counting_commit
+
+    results = {}
+    main.compositor.activate(layer)
+    for name, (effect_in, effect_out, _, easing_in, easing_out) in main.all_animations.items():
+        main.layer_states[layer].phase = IDLE
+        main.set_idle_levels()
+        results[name] = {
+            "in": await bench_effect(main, lambda: effect_in(animations, easing_in), ANIMATE_IN, frames),
+            "out": await bench_effect(main, lambda: effect_out(animations, easing_out), ANIMATE_OUT, frames),
+        }
+    main.layer_states[layer].phase = IDLE
+    main.compositor.release(layer)
+    animations.commit = commit
+    return results
+
+
+def bench_compositor(main, commits=200):
+    # cost of one composited commit by number of active layers, should grow linearly
+    compositor = main.compositor
+    results = {}
+    for active in range(len(compositor.layers) + 1):
+        for layer in range(len(compositor.layers)):
+            compositor.release(layer)
+        for layer in range(active):
+            compositor.activate(layer)
+        start = time.ticks_us()
+        for _ in range(commits):
+            compositor.commit()
+        results[active] = round(time.ticks_diff(time.ticks_us(), start) / commits, 1)
+    for layer in range(len(compositor.layers)):
+        compositor.release(layer)
+    compositor.commit()
+    return results
+
+
+async def bench_wifi():
+    # cold join (scan), then a reconnect from the cached AP, then a stale cache at boot (scan)
+    # and in the background (no scan)
+    import network
+    from lib import wifi as wifi_mod
+    from lib.wifi import WiFi
+
+    wifi_mod.FAST_JOIN_TIMEOUT_MS = 100
+    sta = network.WLAN(network.STA_IF)
+    results = {}
+    for step in ("cold", "cached", "stale_cache", "rejoin"):
+        if step in ("stale_cache", "rejoin"):
+            with open(wifi_mod.CACHE_PATH, "wb") as f:
+                f.write(b"\x02\x00\x00\x00\x00\x99\x01")
+        sta.disconnect()
+        scans = sta.scans
+        wifi = WiFi("bench", "bench")
+        start = time.ticks_ms()
+        connected = await wifi.connect(scan=step != "rejoin")
+        results[step] = {
+            "connected": connected,
+            "join": wifi.last_join,
+            "scans": sta.scans - scans,
+            "connect_ms": time.ticks_diff(time.ticks_ms(), start),
+        }
+    return results
+
+
+async def bench_hass(main, broker, commands):
+    from lib.mqtt import MQTTClient
+    from lib.hass import command_topic, state_topic
+
+    main.start_hass()
+
+    states = asyncio.Queue()
+    observer = MQTTClient("stairs-bench-observer", "127.0.0.1", port=broker.port)
+    observer.set_callback(lambda topic, msg: states.put_nowait(msg))
+    observer.subscribe(state_topic)
+    observer_task = asyncio.create_task(observer.run())
+
+    while not (main.hass.client.isconnected() and observer.isconnected()):
+        await asyncio.sleep_ms(10)
+    # retained + on-connect state documents
+    await asyncio.sleep_ms(100)
+    while not states.empty():
+        states.get_nowait()
+
+    publishes = broker.publishes
+    round_trips = []
+    for i in range(commands):
+        start = time.ticks_us()
+        observer.publish(command_topic, json.dumps({"animation_pause": 1 + i % 600}))
+        await states.get()
+        round_trips.append(time.ticks_diff(time.ticks_us(), start))
+    await asyncio.sleep_ms(50)
+
+    observer_task.cancel()
+    round_trips.sort()
+    return {
+        "commands": commands,
+        # publishes per command seen by the broker: the command itself plus state updates
+        "publishes_per_command": round((broker.publishes - publishes) / commands, 2),
+        "round_trip_us_median": round_trips[len(round_trips) // 2],
+        "round_trip_us_max": round_trips[-1],
+    }
+
+
+def print_results(results):
+    print()
+    print("channels:", results["channels"])
+    header = ("effect", "dir", "dur ms", "cfg ms", "frames", "fps", "i2c tx", "i2c B")
+    print("%-14s %-4s %9s %9s %7s %6s %8s %8s" % header)
+    for name, directions in results["animations"].items():
+        for direction, r in directions.items():
+            print(
+                "%-14s %-4s %9d %9d %7d %6.1f %8d %8d"
+                % (
+                    name,
+                    direction,
+                    r["duration_ms"],
+                    r["configured_ms"],
+                    r["frames"],
+                    r["fps"],
+                    r["i2c_transactions"],
+                    r["i2c_bytes"],
+                )
+            )
+    print()
+    print("compositor commit us by active layers:", results["compositor_commit_us"])
+    print("hass:", results["hass"])
+    print("wifi:", results["wifi"])
+
+
+async def shutdown():
+    # stop the MQTT clients and broker connections before the loop goes away
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run(args):
+    broker = Broker()
+    await broker.start()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    main = load_main(broker.port, args.boards, args.output)
+    main.animation.duration = args.duration
+
+    results = {
+        "implementation": sys.implementation.name,
+        "channels": main.num_output_channels,
+        "animations": await bench_animations(main),
+        "compositor_commit_us": bench_compositor(main),
+        "hass": await bench_hass(main, broker, args.commands),
+        "wifi": await bench_wifi(),
+    }
+    from lib.metrics import metrics
+
+    results["metrics"] = metrics.snapshot()
+    await shutdown()
+    broker.close()
+
+    print_results(results)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="host benchmarks for the firmware")
+    parser.add_argument("--duration", type=int, default=1, help="animation duration in seconds")
+    parser.add_argument("--commands", type=int, default=50, help="Hass commands to round trip")
+    parser.add_argument("--boards", type=int, default=1, help="PCA9685 boards in the channel map")
+    parser.add_argument(
+        "--output", choices=("pca9685", "null", "recording"), default="pca9685", help="output driver"
+    )
+    parser.add_argument("--json", help="write results as JSON to this path")
+    asyncio.run(run(parser.parse_args()))
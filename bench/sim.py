@@ -0,0 +1,171 @@
+# Virtual-clock simulation of the firmware (CPython only).
+# asyncio runs on a loop whose clock jumps straight to the next timer instead of waiting,
+# and time.ticks_ms follows it, so a full trigger -> animate_in -> pause -> animate_out
+# cycle or a day of stair traffic runs in well under a second of real time.
+# Every committed frame is recorded into a per-channel timeline for assertions and profiling.
+
+import asyncio
+import os
+import selectors
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compat  # noqa: E402
+
+compat.install()
+
+from lib.state import PHASE_NAMES  # noqa: E402
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class VirtualSelector(selectors.SelectSelector):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        # only the loop's own wakeup pipe is registered, never actually wait on it
+        events = super().select(0)
+        if events:
+            return events
+        if timeout is None:
+            raise RuntimeError("simulation deadlock: nothing scheduled")
+        self.clock.now += timeout
+        return []
+
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        super().__init__(VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now
+
+
+class Timeline:
+    def __init__(self, num_channels):
+        # channel -> [(t_ms, value), ...], one entry per change
+        self.channels = [[] for _ in range(num_channels)]
+        self.frames = 0
+        self._last_frame_ms = None
+        self._first_frames = []
+
+    def record(self, t_ms, values):
+        self.frames += 1
+        # keep only the first frame of each burst, enough for latency checks over a day
+        if self._last_frame_ms is None or t_ms - self._last_frame_ms > 1000:
+            self._first_frames.append(t_ms)
+        self._last_frame_ms = t_ms
+        for i, changes in enumerate(self.channels):
+            value = values[i]
+            if not changes or changes[-1][1] != value:
+                changes.append((t_ms, value))
+
+    def value_at(self, channel, t_ms):
+        value = None
+        for t, v in self.channels[channel]:
+            if t > t_ms:
+                break
+            value = v
+        return value
+
+    def first_frame(self, after_ms=0):
+        for t in self._first_frames:
+            if t >= after_ms:
+                return t
+        return None
+
+    def first_change(self, channel, after_ms=0):
+        for t, _ in self.channels[channel]:
+            if t > after_ms:
+                return t
+        return None
+
+
+class Simulation:
+    def __init__(self):
+        self.clock = VirtualClock()
+        compat.set_clock(self.clock)
+        self.loop = VirtualLoop(self.clock)
+        asyncio.set_event_loop(self.loop)
+
+        from run import load_main
+
+        self.main = load_main(0)
+        self.timeline = Timeline(self.main.num_output_channels)
+
+        main = self.main
+        # every layer commits through the compositor
+        commit = main.compositor.commit
+
+        def recording_commit():
+            commit()
+            self.timeline.record(self.now_ms(), main.output.values)
+
+        main.compositor.commit = recording_commit
+
+    def now_ms(self):
+        return int(self.clock.now * 1000)
+
+    async def start(self):
+        from lib.trigger import Trigger
+
+        main = self.main
+        main.set_idle_levels()
+        self.timeline.record(self.now_ms(), main.output.values)
+        self._tasks = [
+            asyncio.create_task(main.compositor.run(main.FRAME_MS)),
+            asyncio.create_task(main.run_animations(main.TRIGGER1_LAYER)),
+            asyncio.create_task(main.run_animations(main.TRIGGER2_LAYER)),
+        ]
+        self.trigger1 = Trigger(main.trigger1_pin)
+        self.trigger1.press_func(main.handle_trigger1_fire)
+        self.trigger2 = Trigger(main.trigger2_pin)
+        self.trigger2.press_func(main.handle_trigger2_fire)
+
+    async def step_on(self, trigger=2, hold_ms=300):
+        # sensors pull the pin low while somebody is on the step
+        pin = self.main.trigger1_pin if trigger == 1 else self.main.trigger2_pin
+        pin.drive(0)
+        await asyncio.sleep_ms(hold_ms)
+        pin.drive(1)
+
+    def phase_reached(self, phase, trigger):
+        # trigger None: every trigger layer
+        states = self.main.layer_states
+        if trigger is not None:
+            return states[trigger - 1].phase == phase
+        for state in states:
+            if state.phase != phase:
+                return False
+        return True
+
+    async def wait_for_phase(self, phase, trigger=None, timeout_ms=600000):
+        deadline = self.now_ms() + timeout_ms
+        while not self.phase_reached(phase, trigger):
+            if self.now_ms() > deadline:
+                raise TimeoutError("phase %s not reached" % PHASE_NAMES[phase])
+            await asyncio.sleep_ms(10)
+
+    def run(self, scenario):
+        async def wrapped():
+            await self.start()
+            try:
+                return await scenario(self)
+            finally:
+                self.trigger1.deinit()
+                self.trigger2.deinit()
+                for task in self._tasks:
+                    task.cancel()
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        return self.loop.run_until_complete(wrapped())
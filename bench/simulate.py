@@ -0,0 +1,128 @@
+# Runs stair scenarios on the virtual clock:
+#   python bench/simulate.py cycle [--json timeline.json]
+#   python bench/simulate.py crossing
+#   python bench/simulate.py day [--walks 300] [--seed 1]
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sim import Simulation  # noqa: E402
+from lib.state import IDLE, ANIMATE_IN, PAUSE  # noqa: E402
+from lib.metrics import metrics  # noqa: E402
+
+
+async def cycle(sim):
+    main = sim.main
+    a = main.animation
+    start = sim.now_ms()
+    await sim.step_on(2)
+    await sim.wait_for_phase(PAUSE, 2)
+    lit = sim.now_ms()
+    await sim.wait_for_phase(IDLE, 2)
+    done = sim.now_ms()
+
+    timeline = sim.timeline
+    last = main.num_output_channels - 1
+    assert timeline.value_at(last, lit) == a.level_max, "stairs not fully lit after animate_in"
+    for i in range(main.num_output_channels):
+        assert main.output.values[i] == main.channels.low[i], "channel %d not back at idle" % i
+    assert done - start >= a.pause_time * 1000, "pause cut short"
+
+    return {
+        "trigger_to_first_frame_ms": timeline.first_frame(start) - start,
+        "trigger_to_first_change_ms": timeline.first_change(0, start) - start,
+        "animate_in_ms": lit - start,
+        "cycle_ms": done - start,
+        "frames": timeline.frames,
+    }
+
+
+async def crossing(sim):
+    # somebody walks up while somebody else is already walking down, both waves run on
+    # their own layer and neither holds up the other
+    main = sim.main
+    a = main.animation
+    start = sim.now_ms()
+    await sim.step_on(1)
+    await asyncio.sleep_ms(a.duration * 1000 // 2)
+    second = sim.now_ms()
+    assert main.layer_states[0].phase == ANIMATE_IN, "first animation not running"
+    await sim.step_on(2)
+    assert main.layer_states[0].phase == ANIMATE_IN, "first animation interrupted"
+    await sim.wait_for_phase(PAUSE, 1)
+    first_lit = sim.now_ms()
+    await sim.wait_for_phase(PAUSE, 2)
+    second_lit = sim.now_ms()
+    for i in range(main.num_output_channels):
+        assert main.output.values[i] == a.level_max, "channel %d not lit with both layers up" % i
+    await sim.wait_for_phase(IDLE)
+    done = sim.now_ms()
+    for i in range(main.num_output_channels):
+        assert main.output.values[i] == main.channels.low[i], "channel %d not back at idle" % i
+
+    return {
+        "first_animate_in_ms": first_lit - start,
+        "second_animate_in_ms": second_lit - second,
+        "cycle_ms": done - start,
+        "frames": sim.timeline.frames,
+    }
+
+
+def day(walks, seed):
+    async def scenario(sim):
+        rng = random.Random(seed)
+        day_ms = 24 * 3600 * 1000
+        # walk start times spread over the day, from either end of the stairs
+        times = sorted(rng.randrange(day_ms) for _ in range(walks))
+        for t in times:
+            delay = t - sim.now_ms()
+            if delay > 0:
+                await asyncio.sleep_ms(delay)
+            await sim.step_on(rng.choice((1, 2)))
+        await sim.wait_for_phase(IDLE)
+        counters = metrics.counters
+        return {
+            "walks": walks,
+            "virtual_ms": sim.now_ms(),
+            "frames": sim.timeline.frames,
+            "frame_cache_hits": counters["frame_cache_hits"],
+            "frame_cache_misses": counters["frame_cache_misses"],
+        }
+
+    return scenario
+
+
+def run(args):
+    sim = Simulation()
+    scenarios = {"cycle": cycle, "crossing": crossing}
+    scenario = scenarios.get(args.scenario) or day(args.walks, args.seed)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+        result = sim.run(scenario)
+    result["wall_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(args.scenario, result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"result": result, "timeline": sim.timeline.channels}, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="virtual-clock stair scenarios")
+    parser.add_argument("scenario", choices=("cycle", "crossing", "day"))
+    parser.add_argument("--walks", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write result and per-channel timeline as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show firmware prints")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    run(args)
@@ -1,197 +1,227 @@
 import asyncio
 import time
+from array import array
+from lib.easing import SHIFT, curve, ease
+from lib.metrics import metrics
+from lib.rain import PackedFrames
+from lib.state import ANIMATE_IN, ANIMATE_OUT
 
-# TODO:
-# - what would be the best was if the PCA9685 would allow a bulk update of all channels at once, but it doesn't, then we would have animation frames and it would be so much better
+# renderer target frame rate, each frame is computed from elapsed time so the
+# animation length doesn't depend on how long a frame takes to write out
+FRAME_RATE = 50
+FRAME_MS = 1000 // FRAME_RATE
 
 
 class Animations:
-    def __init__(self, animation, state, set_channel_value, get_channel_value):
+    # output: driver with stage(index, value), get(index) and commit(), effects stage a whole
+    # frame and commit it once, cache: FrameCache to replay rendered sequences from, or None
+    def __init__(self, animation, state, channels, output, cache=None):
         self.animation = animation
-        self.set_channel = set_channel_value
-        self.get_channel = get_channel_value
+        self.cache = cache
+        self.stage = output.stage
+        self.get_channel = output.get
+        self.commit = output.commit
         self.main_state = state
+        self.channels = channels
+        # channel levels at the start of the running animation
+        self._from = array("H", channels.low)
+        # easing table of the running animation, see lib/easing.py
+        self._easing = curve("linear")
+        # frame sequence being replayed or recorded, rows recorded so far and the effect's
+        # frame function while recording
+        self._sequence = None
+        self._recorded = 0
+        self._live_frame = None
 
-    async def wave_in(self):
-        print("animation wave in started")
+    async def _render(self, name, phase, frame, easing):
+        print("animation", name, "started")
 
-        a = self.animation
-
-        start_time = time.ticks_ms()
-
-        num_chan = len(self.main_state["channels_low"])
+        self._easing = curve(easing)
 
-        indexes = range(num_chan)
+        state = self.main_state
 
-        channel_indexes = indexes if a["direction"] == "forward" else reversed(indexes)
+        start_time = time.ticks_ms()
 
-        channel_dur = a["duration"] * 120 // num_chan
+        num_chan = len(self._from)
 
-        end_level = a["level_max"]
+        for i in range(num_chan):
+            self._from[i] = self.get_channel(i)
 
-        for i in channel_indexes:
-            # read current level from memory
-            initial_level = self.get_channel(i)
-            # start from current level, if above min level (error correction)
-            start_level = max(initial_level, a["level_min"])
-            # skip if channel is already at target
-            if end_level == start_level:
-                continue
-            step = (end_level - start_level) // channel_dur if channel_dur > 0 else 1
-            # pull to end_level
-            levels = list(range(start_level, end_level, step))
-            levels[-1] = end_level
-            for level in levels:
+        a = self.animation
+        duration_ms = a.duration * 1000
+
+        # replay the sequence if it's cached, otherwise record it on the frame grid while
+        # rendering so the next run with the same parameters and start levels can replay it
+        render = frame
+        key = None
+        recording = False
+        self._sequence = None
+        if self.cache is not None:
+            key = (name, easing, state.forward, duration_ms, a.level_min, a.level_max, a.edge_glow, bytes(self._from))
+            rows = duration_ms // FRAME_MS + 1
+            self._sequence = self.cache.get(key)
+            if self._sequence is not None:
+                render = self._replay_frame
+            else:
+                self._sequence = self.cache.reserve(rows, num_chan)
+                if self._sequence is not None:
+                    self._recorded = 0
+                    self._live_frame = frame
+                    render = self._record_frame
+                    recording = True
+
+        try:
+            while True:
                 # break out if animation was terminated
-                if a["state"] != "animate_in":
-                    print("animation wave in terminated")
+                if state.phase != phase:
+                    print("animation", name, "terminated")
                     return
-                # pull to max level so they aren't stuck not fully lit
-                self.set_channel(i, level)
-                await asyncio.sleep_ms(1)
+                frame_time = time.ticks_ms()
+                elapsed = min(time.ticks_diff(frame_time, start_time), duration_ms)
+                self.render_frame(render, elapsed, duration_ms)
+                if elapsed >= duration_ms:
+                    break
+                # sleep for whatever is left of this frame
+                await asyncio.sleep_ms(max(FRAME_MS - time.ticks_diff(time.ticks_ms(), frame_time), 0))
+
+            if recording:
+                # the reservation made room for it
+                recording = False
+                self.cache.release(self._sequence)
+                self.cache.put(key, self._sequence)
+        finally:
+            if recording:
+                self.cache.release(self._sequence)
+            self._sequence = None
+            self._live_frame = None
+
         print(
-            "animation wave in took ",
+            "animation",
+            name,
+            "took",
             time.ticks_diff(time.ticks_ms(), start_time),
             "ms",
         )
 
-    async def wave_out(self):
-        print("animation wave out started")
-
-        a = self.animation
-
-        start_time = time.ticks_ms()
-
-        idles = self.main_state["channels_low"]
-
-        num_chan = len(idles)
+    def render_frame(self, frame, elapsed, duration_ms):
+        # per-frame hot path, must not allocate (bench/alloc.py checks this on the unix port)
+        frame_start_us = time.ticks_us()
+        frame(elapsed, duration_ms)
+        self.commit()
+        metrics.observe("frame_us", time.ticks_diff(time.ticks_us(), frame_start_us))
+        metrics.incr("frames")
+        metrics.frame_committed()
+
+    def _replay_frame(self, elapsed, duration_ms):
+        sequence = self._sequence
+        num_chan = len(self._from)
+        base = elapsed // FRAME_MS * num_chan * 2
+        for i in range(num_chan):
+            j = base + 2 * i
+            self.stage(i, sequence[j] | sequence[j + 1] << 8)
+
+    def _record_frame(self, elapsed, duration_ms):
+        # renders every grid frame up to elapsed, the output shows the last one so a replay
+        # looks the same as this first run
+        sequence = self._sequence
+        num_chan = len(self._from)
+        row = elapsed // FRAME_MS
+        while self._recorded <= row:
+            self._live_frame(self._recorded * FRAME_MS, duration_ms)
+            base = self._recorded * num_chan * 2
+            for i in range(num_chan):
+                level = self.get_channel(i)
+                sequence[base + 2 * i] = level & 0xFF
+                sequence[base + 2 * i + 1] = level >> 8
+            self._recorded += 1
 
-        indexes = range(num_chan)
+    def _wave_frame(self, elapsed, duration_ms, end_levels, end_level, min_start_level):
+        num_chan = len(self._from)
 
-        channel_indexes = indexes if a["direction"] == "forward" else reversed(indexes)
+        forward = self.main_state.forward
 
-        channel_dur = a["duration"] * 120 // num_chan
+        # channels light up one after another, each gets an equal slice of the duration
+        channel_dur = max(duration_ms // num_chan, 1)
 
-        for i in channel_indexes:
-            start_level = self.get_channel(i)
-            end_level = idles[i]
-            if end_level == start_level:
+        for n in range(num_chan):
+            i = n if forward else num_chan - 1 - n
+            channel_elapsed = elapsed - n * channel_dur
+            # channel's turn hasn't come yet, leave it alone
+            if channel_elapsed <= 0:
                 continue
-            step = (start_level - end_level) // channel_dur if channel_dur > 0 else 1
-
-            levels = list(range(start_level, end_level, -step))
-            # pull to min level so they aren't stuck not fully off
-            levels[-1] = end_level
-            for level in levels:
-                # break out if animation was terminated
-                if a["state"] != "animate_out":
-                    print("animation wave out terminated")
-                    return
-                self.set_channel(i, level)
-                await asyncio.sleep_ms(1)
-
-        print(
-            "animation wave out took ",
-            time.ticks_diff(time.ticks_ms(), start_time),
-            "ms",
-        )
-
-    async def breathe_in(self):
-        print("animation breathe in started")
-
+            if end_levels is not None:
+                end_level = end_levels[i]
+            start_level = max(self._from[i], min_start_level)
+            if channel_elapsed >= channel_dur:
+                # pull to end level so they aren't stuck not fully lit / not fully off
+                self.stage(i, end_level)
+            else:
+                progress = ease(self._easing, channel_elapsed, channel_dur)
+                self.stage(i, start_level + ((end_level - start_level) * progress >> SHIFT))
+
+    def _wave_in_frame(self, elapsed, duration_ms):
         a = self.animation
+        # start from current level, if above min level (error correction)
+        self._wave_frame(elapsed, duration_ms, None, a.level_max, a.level_min)
 
-        start_time = time.ticks_ms()
-
-        num_chan = len(self.main_state["channels_low"])
+    def _wave_out_frame(self, elapsed, duration_ms):
+        self._wave_frame(elapsed, duration_ms, self.channels.low, 0, 0)
 
-        delta_level = a["level_max"] - a["level_min"]
+    def _breathe_in_frame(self, elapsed, duration_ms):
+        a = self.animation
+        start = self._from
+        level = a.level_min + ((a.level_max - a.level_min) * ease(self._easing, elapsed, duration_ms) >> SHIFT)
+        for i in range(len(start)):
+            # start higher if channel isn't initially at min level
+            self.stage(i, max(level, start[i]))
 
-        if delta_level == 0:
+    def _breathe_out_frame(self, elapsed, duration_ms):
+        a = self.animation
+        start = self._from
+        idles = self.channels.low
+        level = a.level_max - ((a.level_max - a.level_min) * ease(self._easing, elapsed, duration_ms) >> SHIFT)
+        for i in range(len(start)):
+            # start lower if channel isn't initially at max
+            # but don't go lower than idle value
+            self.stage(i, max(min(level, start[i]), idles[i]))
+
+    # easing: curve name from lib/easing.py, wave eases every channel's own ramp
+    async def wave_in(self, easing="linear"):
+        await self._render("wave in", ANIMATE_IN, self._wave_in_frame, easing)
+
+    async def wave_out(self, easing="linear"):
+        await self._render("wave out", ANIMATE_OUT, self._wave_out_frame, easing)
+
+    async def breathe_in(self, easing="linear"):
+        a = self.animation
+        if a.level_max == a.level_min:
             return
+        await self._render("breathe in", ANIMATE_IN, self._breathe_in_frame, easing)
 
-        iter_time_ms = num_chan + 1
-
-        # animation duration = delta level * iteration time / level step
-        # so
-        # step = delta level * iteration time / animation duration
-
-        a_duration_ms = a["duration"] * 1000
-
-        step = delta_level * iter_time_ms // a_duration_ms
-
-        levels = list(range(a["level_min"], a["level_max"], step))
-        levels[-1] = a["level_max"]
-
-        for level in levels:
-            for i in range(num_chan):
-                # break out if animation was terminated
-                if a["state"] != "animate_in":
-                    print("animation breathe in terminated")
-                    return
-                # start higher if channel isn't initially at min level
-                self.set_channel(i, max(level, self.get_channel(i)))
-            await asyncio.sleep_ms(1)
-        print(
-            "animation breathe in took ",
-            time.ticks_diff(time.ticks_ms(), start_time),
-            "ms",
-        )
-
-    async def breathe_out(self):
-        print("animation breathe out started")
-
+    async def breathe_out(self, easing="linear"):
         a = self.animation
-        idles = self.main_state["channels_low"]
-
-        start_time = time.ticks_ms()
-
-        num_chan = len(idles)
-
-        delta_level = a["level_max"] - a["level_min"]
-
-        if delta_level == 0:
+        if a.level_max == a.level_min:
             return
+        await self._render("breathe out", ANIMATE_OUT, self._breathe_out_frame, easing)
 
-        iter_time_ms = num_chan + 1
-
-        a_duration_ms = a["duration"] * 1000
-
-        step = delta_level * iter_time_ms // a_duration_ms
-
-        levels = list(range(a["level_max"], a["level_min"], -step))
-        # pull to min level so they aren't stuck not fully off
-        levels[-1] = a["level_min"]
-
-        for level in levels:
-            for i in range(num_chan):
-                # break out if animation was terminated
-                if a["state"] != "animate_out":
-                    print("animation breathe out terminated")
-                    return
-                # start lower if channel isn't initially at max
-                # but don't go lower than idle value
-                self.set_channel(i, max(min(level, self.get_channel(i)), idles[i]))
-            await asyncio.sleep_ms(1)
-        print(
-            "animation breathe in took ",
-            time.ticks_diff(time.ticks_ms(), start_time),
-            "ms",
-        )
-
-    async def rain(self):
+    async def rain(self, path="rain.bin"):
         print("animation rain started")
 
-        # num_chan = len(self.main_state["channels_low"])
-
-        # sequence = noise_data
-        # dir = True
-        # num_rows = len(sequence)
-        # indexes = range(num_rows)
-        # while True:
-        #     for row in indexes:
-        #         for i in range(num_chan):
-        #             self.set_channel(i, sequence[row if dir else num_rows - row - 1][i])
-        #         await asyncio.sleep_ms(10)
-        #     dir = not dir
-        #     print("ding", dir)
\ No newline at end of file
+        frames = PackedFrames(path)
+
+        num_chan = min(len(self._from), frames.channels)
+        num_rows = frames.rows
+
+        # play the sequence forward, then backward, forever
+        forward = True
+        try:
+            while True:
+                for row in range(num_rows):
+                    values = frames.read_row(row if forward else num_rows - row - 1)
+                    for i in range(num_chan):
+                        self.stage(i, values[i])
+                    self.commit()
+                    await asyncio.sleep_ms(10)
+                forward = not forward
+        finally:
+            frames.close()
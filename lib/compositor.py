@@ -0,0 +1,101 @@
+# Blends independent animation layers (one per stair trigger, rain, ...) over the idle
+# levels into the output. Every layer has a preallocated buffer and the same stage/get/commit
+# interface as the output, so effects render into a layer just like they'd render straight
+# to the output. A commit costs O(channels x active layers). Layer commits only ask for one,
+# run() composites and flushes at most once per frame period however many layers animate.
+
+from array import array
+
+# blend modes: brightest layer wins, or layers add their light above idle (clamped)
+MAX = 0
+ADD = 1
+
+
+class Layer:
+    def __init__(self, compositor, count):
+        self.compositor = compositor
+        self.values = array("H", [0] * count)
+
+    def stage(self, index, value):
+        self.values[index] = value
+
+    def get(self, index):
+        return self.values[index]
+
+    def commit(self):
+        self.compositor.request()
+
+
+class Compositor:
+    # base: idle levels under all layers (ChannelBuffer.low), updated in place by the owner
+    def __init__(self, output, base, layers=2, mode=MAX):
+        self.output = output
+        self.base = base
+        self.mode = mode
+        self.layers = [Layer(self, len(base)) for _ in range(layers)]
+        # bit n set -> layer n is blended in
+        self._active = 0
+        self._frame = array("H", base)
+        # created by run(), asyncio isn't needed (or imported) before the first frame
+        self._changed = None
+
+    def activate(self, n):
+        # an inactive layer starts out from the idle levels, an active one keeps what it shows
+        if self._active & (1 << n):
+            return
+        values = self.layers[n].values
+        base = self.base
+        for i in range(len(base)):
+            values[i] = base[i]
+        self._active |= 1 << n
+
+    def release(self, n):
+        self._active &= ~(1 << n)
+
+    def request(self):
+        # a layer has a new frame, composited right away without a run() task (host tools)
+        if self._changed is None:
+            self.commit()
+        else:
+            self._changed.set()
+
+    async def run(self, period_ms):
+        # layer commits within a frame period share one composite and one output flush
+        import asyncio
+        import time
+
+        self._changed = asyncio.Event()
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            start = time.ticks_ms()
+            self.commit()
+            await asyncio.sleep_ms(max(period_ms - time.ticks_diff(time.ticks_ms(), start), 0))
+
+    def commit(self):
+        base = self.base
+        frame = self._frame
+        count = len(base)
+        for i in range(count):
+            frame[i] = base[i]
+
+        active = self._active
+        n = 0
+        while active:
+            if active & 1:
+                values = self.layers[n].values
+                if self.mode == MAX:
+                    for i in range(count):
+                        if values[i] > frame[i]:
+                            frame[i] = values[i]
+                else:
+                    for i in range(count):
+                        if values[i] > base[i]:
+                            frame[i] = min(frame[i] + values[i] - base[i], 4095)
+            active >>= 1
+            n += 1
+
+        output = self.output
+        for i in range(count):
+            output.stage(i, frame[i])
+        output.commit()
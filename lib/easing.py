@@ -0,0 +1,71 @@
+# Easing curves as small fixed-point tables, so effects can ease in/out with integer math
+# only. Each curve is sampled at STEPS + 1 points into an array("H") of progress values in
+# 0..ONE and linearly interpolated in between.
+
+import math
+from array import array
+
+# progress fixed point, level = start + (end - start) * progress >> SHIFT
+SHIFT = 12
+ONE = 1 << SHIFT
+STEPS = 32
+# interpolation between samples, fraction bits
+_FRAC = 8
+
+
+def _quad(t):
+    return t * t
+
+
+def _cubic(t):
+    return t * t * t
+
+
+def _sine(t):
+    return 1 - math.cos(t * math.pi / 2)
+
+
+def _expo(t):
+    return 0 if t == 0 else 2 ** (10 * t - 10)
+
+
+# name -> ease-in function of 0..1, _out and _in_out variants are derived from it
+_SHAPES = {"quad": _quad, "cubic": _cubic, "sine": _sine, "expo": _expo}
+
+# name -> sampled table, built on first use
+_tables = {}
+
+
+def _sample(name):
+    if name == "linear":
+        return lambda t: t
+    shape, _, variant = name.partition("_")
+    f = _SHAPES[shape]
+    if variant == "in":
+        return f
+    if variant == "out":
+        return lambda t: 1 - f(1 - t)
+    if variant == "in_out":
+        return lambda t: f(2 * t) / 2 if t < 0.5 else 1 - f(2 - 2 * t) / 2
+    raise KeyError(name)
+
+
+def curve(name):
+    # "linear" or "<quad|cubic|sine|expo>_<in|out|in_out>"
+    table = _tables.get(name)
+    if table is None:
+        f = _sample(name)
+        table = _tables[name] = array("H", (int(f(n / STEPS) * ONE + 0.5) for n in range(STEPS + 1)))
+    return table
+
+
+def ease(table, elapsed, duration):
+    # eased progress (0..ONE) after elapsed of duration, integer only, doesn't allocate
+    if elapsed >= duration:
+        return ONE
+    if elapsed <= 0:
+        return 0
+    position = (elapsed << _FRAC) * STEPS // duration
+    n = position >> _FRAC
+    a = table[n]
+    return a + ((table[n + 1] - a) * (position & ((1 << _FRAC) - 1)) >> _FRAC)
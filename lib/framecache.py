@@ -0,0 +1,71 @@
+# Rendered animation frame sequences kept for replay, keyed by everything the frames depend
+# on (see Animations._render). A sequence is one bytearray of frames x channels levels on
+# the FRAME_MS grid, two bytes per level, low byte first. Least recently used sequences are
+# evicted to stay within the RAM budget, which also covers the buffers of recordings still in
+# flight, so the room is made before a recording buffer is allocated rather than when it's put.
+
+from lib.metrics import metrics
+
+
+class FrameCache:
+    def __init__(self, budget=16384):
+        # bytes
+        self.budget = budget
+        self.used = 0
+        # bytes of recording buffers handed out by reserve() and not released yet
+        self.reserved = 0
+        self._sequences = {}
+        # keys, least recently used first
+        self._order = []
+
+    def reserve(self, frames, channels):
+        # buffer to record a sequence into, or None if there's no room for it next to the other
+        # recordings in flight, counts against the budget until release()
+        size = frames * channels * 2
+        # don't evict anything for a buffer that can't fit anyway
+        if size + self.reserved > self.budget:
+            return None
+        while self.used + self.reserved + size > self.budget:
+            if not self._order:
+                return None
+            self.used -= len(self._sequences.pop(self._order.pop(0)))
+        self.reserved += size
+        # a bytearray is allocated at its final size, an array("H") would be copied from one
+        return bytearray(size)
+
+    def release(self, sequence):
+        # recording done or abandoned, put() it afterwards to keep it
+        self.reserved -= len(sequence)
+
+    def get(self, key):
+        sequence = self._sequences.get(key)
+        if sequence is None:
+            metrics.incr("frame_cache_misses")
+            return None
+        metrics.incr("frame_cache_hits")
+        order = self._order
+        order.remove(key)
+        order.append(key)
+        return sequence
+
+    def put(self, key, sequence):
+        size = len(sequence)
+        if size > self.budget or key in self._sequences:
+            return
+        while self.used + self.reserved + size > self.budget:
+            if not self._order:
+                return
+            self.used -= len(self._sequences.pop(self._order.pop(0)))
+        self._sequences[key] = sequence
+        self._order.append(key)
+        self.used += size
+
+    def clear(self):
+        # levels or effect changed, the old sequences won't be replayed any more
+        self._sequences = {}
+        self._order = []
+        self.used = 0
+
+
+metrics.counter("frame_cache_hits")
+metrics.counter("frame_cache_misses")
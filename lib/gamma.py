@@ -0,0 +1,55 @@
+# 12 bit level -> 12 bit PWM duty lookup so brightness steps look even to the eye.
+# ChannelOutput passes everything it sends out through the table, animations keep
+# working with linear levels. Gamma is in tenths, 10 is linear, 0 is the CIE 1931
+# lightness curve.
+
+from array import array
+
+SIZE = 4096
+LINEAR = 10
+CIE = 0
+# entries per rebuild step, a few ms on the ESP32
+CHUNK = 256
+
+
+def _duty(gamma, level):
+    if gamma == CIE:
+        lightness = level * 100 / 4095
+        if lightness <= 8:
+            y = lightness / 903.3
+        else:
+            y = ((lightness + 16) / 116) ** 3
+    else:
+        y = (level / 4095) ** (gamma / 10)
+    return int(y * 4095 + 0.5)
+
+
+class GammaTable:
+    def __init__(self):
+        # boots linear, so the first frame doesn't wait for the curve
+        self.table = array("H", range(SIZE))
+        self.gamma = LINEAR
+        # the next curve is built here and swapped with table once complete
+        self._scratch = None
+
+    async def rebuild(self, gamma):
+        # in steps so frames keep going, returns False if nothing changed or a newer
+        # rebuild took over, frames keep using the old table until it returns True
+        import asyncio
+
+        if gamma == self.gamma:
+            return False
+        self.gamma = gamma
+        if self._scratch is None:
+            self._scratch = array("H", bytearray(2 * SIZE))
+        scratch = self._scratch
+        for start in range(0, SIZE, CHUNK):
+            if self.gamma != gamma:
+                return False
+            for level in range(start, start + CHUNK):
+                scratch[level] = _duty(gamma, level)
+            await asyncio.sleep_ms(0)
+        if self.gamma != gamma:
+            return False
+        self.table, self._scratch = scratch, self.table
+        return True
@@ -1,107 +1,117 @@
-from umqtt.robust import MQTTClient
+from lib.mqtt import MQTTClient
 from ujson import loads, dumps
 import asyncio
-
-CONFIG = loads(open("config.json").read())
+from lib.metrics import metrics
 
 # TODO:
-# - (not needed with the below) send full state to HA when requested (when HA restarts) - done, but needs fix in HA
-# - switch to MQTT Light JSON schema
-# - - flash time short could be animation duration, long could be pause time
-# - - min_mireds and max_mireds could be level_min and edge_low, respectively
-# - - brightness is already done
-# - - effect is already done
-# - - if step is removed then everything is done via built-in properties so most of the automation can be removed
-# - - including all the property topics and handle_properties
-
-
-# MQTT topics
-state_request_topic = b"home/stairs_light_ctrl/state_request"
-state_response_topic = b"home/stairs_light_ctrl/state_response"
-# every settable property has its own topic, like home/stairs_light_ctrl/properties/max_brightness/set
-
-# MQTT Light topics, TODO: would be simpler to use MQTT Light JSON schema
+# - flash time short could be animation duration, long could be pause time
+# - min_mireds and max_mireds could be level_min and edge_low, respectively
+
+
+# MQTT Light JSON schema topics, commands and state are one compact JSON document each
+# HA side:
+#   mqtt:
+#     light:
+#       - schema: json
+#         command_topic: "home/stairs_light_ctrl/set"
+#         state_topic: "home/stairs_light_ctrl/state"
+#         brightness: true
+#         brightness_scale: 4095
+#         effect: true
+#         effect_list: ["Wave", "Breathe", "Breathe In, Wave Out", "Wave In, Breathe Out"]
+# the non-standard properties (idle_brightness, edge_glow, animation_duration, animation_pause,
+# gamma) ride along in the same documents, e.g. {"idle_brightness": 100} sent to the command topic,
+# gamma is in tenths (22 is 2.2, 10 linear, 0 the CIE lightness curve)
 command_topic = b"home/stairs_light_ctrl/set"
 state_topic = b"home/stairs_light_ctrl/state"
-brightness_command_topic = b"home/stairs_light_ctrl/brightness/set"
-brightness_state_topic = b"home/stairs_light_ctrl/brightness/state"
-effect_state_topic = b"home/stairs_light_ctrl/effect/state"
-effect_command_topic = b"home/stairs_light_ctrl/effect/set"
-
-# inverse state update - ESP tells HA it's state so HA can update controls after restart
-state_request_topic_ha = b"home/stairs_light_ctrl/state_request_ha"
-state_response_topic_ha = b"home/stairs_light_ctrl/state_response_ha"
+# runtime metrics snapshot, see lib/metrics.py
+diagnostics_topic = b"home/stairs_light_ctrl/diagnostics"
+diagnostics_interval_s = 60
 
 
 class Hass:
-    def __init__(self, state, animation, all_animations):
+    def __init__(self, state, animation, all_animations, config):
         self.state = state
+        self.config = config
         self.animation = animation
         self.all_animations = all_animations
+        # topic -> handler(msg) and JSON key -> (target, min, max), filled in by connect()
+        self._topics = {}
+        self._properties = {}
+        # effect display name -> all_animations key
+        self._effects = {value[2]: key for key, value in all_animations.items()}
 
     def connect(self):
-        try:
-            self.client = MQTTClient(
-                CONFIG["client_id"],
-                CONFIG["broker"],
-                user=CONFIG["username"],
-                password=CONFIG["password"],
-            )
-            self.client.connect()
-            print("Connected to MQTT broker")
-        except Exception as e:
-            print("Failed to connect to MQTT broker:", e)
-            return
+        # connection is kept up in the background, publishes are queued until it's up
+        config = self.config
+        self.client = MQTTClient(
+            config["client_id"],
+            config["broker"],
+            port=config.get("port", 1883),
+            user=config["username"],
+            password=config["password"],
+        )
         self.client.set_callback(self.callback)
-        # subscribe to each property topic
-        for key in self.get_full_state().keys():
-            self.client.subscribe(b"home/stairs_light_ctrl/properties/" + key + b"/set")
-        self.client.subscribe(command_topic)
-        self.client.subscribe(brightness_command_topic)
-        self.client.subscribe(effect_command_topic)
-        self.client.subscribe(state_response_topic)
-        self.client.subscribe(state_request_topic_ha)
+        self.client.set_connect_callback(self.on_connect)
+
+        self.register_topic(command_topic, self.handle_command_message)
+
+        self.register_property("state", self.handle_command)
+        self.register_property("effect", self.handle_effect_command)
+        self.register_property("brightness", self.handle_brightness_command, 0, 4095)
+        # idle and edge need set_idle_levels, so they go through a cb
+        self.register_property("idle_brightness", self.idle_brightness_cb, 0, 4095)
+        self.register_property("edge_glow", self.edge_glow_cb, 0, 4095)
+        self.register_property("gamma", self.gamma_cb, 0, 30)
+        self.register_property("animation_duration", "duration", 1, 60)
+        self.register_property("animation_pause", "pause_time", 1, 600)
+
+        asyncio.create_task(self.client.run())
+        asyncio.create_task(self.publish_diagnostics())
+
+    def register_topic(self, topic, handler):
+        self._topics[topic] = handler
+        self.client.subscribe(topic)
+
+    def register_property(self, key, target, value_min=None, value_max=None):
+        # target is either an AnimationConfig attribute name or a callable taking the value,
+        # numeric properties (with bounds) are converted to int and clamped first
+        self._properties[key] = (target, value_min, value_max)
+
+    def on_connect(self):
         print("Subscribed to topics")
-        print("Requesting property state from HA")
-        self.client.publish(state_request_topic, "request_state")
-        asyncio.create_task(self.publish_light_state_to_HA())
-
-    async def publish_light_state_to_HA(self, delay=True):
-        # push current state to MQTT Light
-        if delay:
-            await asyncio.sleep(5)
-        print("Sending command state updates to MQTT Light")
-        self.client.publish(state_topic, b"ON" if self.state["on"] else b"OFF")
-        self.client.publish(brightness_state_topic, str(self.animation["level_max"]))
-        self.client.publish(effect_state_topic, self.get_current_effect_name())
-
-    def check_msg(self):
-        self.client.check_msg()
+        # the device is the source of truth (settings restored from flash on boot),
+        # HA is brought in line with it, retained so it picks it up whenever it (re)starts
+        self.publish_state()
+
+    def publish_state(self):
+        self.client.publish(state_topic, dumps(self.get_full_state(), separators=(",", ":")), retain=True)
+
+    async def publish_diagnostics(self):
+        while True:
+            await asyncio.sleep(diagnostics_interval_s)
+            if self.client.isconnected():
+                self.client.publish(diagnostics_topic, dumps(metrics.snapshot(), separators=(",", ":")))
 
     def callback(self, topic, msg):
         print("Received message from topic", topic, ":", msg)
-        if topic.startswith(b"home/stairs_light_ctrl/properties"):
-            self.handle_properties(topic, msg)
-        elif topic == command_topic:
-            self.handle_command(msg)
-        elif topic == brightness_command_topic:
-            self.handle_brightness_command(msg)
-        elif topic == effect_command_topic:
-            self.handle_effect_command(msg)
-        elif topic == state_response_topic:
-            if len(msg) > 0:
-                try:
-                    state = loads(bytearray(msg))
-                    print("Received full state:", state)
-                    self.set_full_state(state)
-                except Exception as e:
-                    print("Failed to parse state response:", e)
-        elif topic == state_request_topic_ha:
-            if msg == b"request_status":
-                state = self.get_full_state()
-                self.client.publish(state_response_topic_ha, dumps(state))
-                asyncio.create_task(self.publish_light_state_to_HA(False))
-                print("Sent state to HA")
+        handler = self._topics.get(topic)
+        if handler is not None:
+            handler(msg)
+
+    def handle_command_message(self, msg):
+        try:
+            command = loads(msg)
+        except ValueError as e:
+            print("Failed to parse command:", e)
+            return
+        if not isinstance(command, dict):
+            print("Ignored command, not a JSON object:", msg)
+            return
+        self.set_full_state(command)
+        self.changed_cb()
+        # one state document per command, whatever it changed
+        self.publish_state()
 
     def set_idle_brightness_cb(self, cb):
         self.idle_brightness_cb = cb
@@ -109,77 +119,70 @@ class Hass:
     def set_edge_glow_cb(self, cb):
         self.edge_glow_cb = cb
 
+    def set_gamma_cb(self, cb):
+        self.gamma_cb = cb
+
+    # called when brightness or effect change what the animations render
+    def set_animation_changed_cb(self, cb):
+        self.animation_changed_cb = cb
+
     def set_enabled_state_cb(self, cb):
         self.enabled_state_cb = cb
 
+    # called after a command changed settings
+    def set_changed_cb(self, cb):
+        self.changed_cb = cb
+
     def set_full_state(self, state):
-        # need to call set_idle_levels for idle and edge, so we can set one directly, but one must go through a cb
-        if "idle_brightness" in state:
-            self.idle_brightness_cb(state["idle_brightness"])
-        if "edge_glow" in state:
-            self.edge_glow_cb(state["edge_glow"])
-        if "duration" in state:
-            self.animation["duration"] = state["animation_duration"]
-        if "animation_pause" in state:
-            self.animation["pause_time"] = state["animation_pause"]
-        
-        # pull current state from MQTT Light before ESP overwrites it in HA
-        if "effect" in state:
-            self.handle_effect_command(state["effect"].encode('ascii'))
-        if "max_brightness" in state:
-            self.animation["level_max"] = state["max_brightness"]
+        properties = self._properties
+        for key in state:
+            entry = properties.get(key)
+            if entry is None:
+                continue
+            target, value_min, value_max = entry
+            value = state[key]
+            # a bad value only drops its own key, the rest of the command still applies
+            try:
+                if value_min is not None:
+                    value = min(max(int(value), value_min), value_max)
+                if isinstance(target, str):
+                    setattr(self.animation, target, value)
+                else:
+                    target(value)
+            except (TypeError, ValueError, OverflowError) as e:
+                print("Ignored", key, "=", value, ":", e)
+                continue
+            print("Set", key, "to", value)
 
     def get_full_state(self):
         return {
-            b"idle_brightness": self.animation["level_min"],
-            b"edge_glow": self.animation["edge_glow"],
-            b"animation_duration": self.animation["duration"],
-            b"animation_pause": self.animation["pause_time"],
-            # removed inputs, as they are now handled by MQTT Light
-            # "max_brightness": self.animation["level_max"],
-            # "effect": self.animation["effect"],
+            "state": "ON" if self.state.on else "OFF",
+            "brightness": self.animation.level_max,
+            "effect": self.get_current_effect_name(),
+            "idle_brightness": self.animation.level_min,
+            "edge_glow": self.animation.edge_glow,
+            "animation_duration": self.animation.duration,
+            "animation_pause": self.animation.pause_time,
+            "gamma": self.animation.gamma,
         }
 
-    def handle_properties(self, topic, msg):
-        key = topic.split(b"/properties/")[1].split(b"/set")[0]
-        print("Received property", key, "with value", msg)
-        if key == b"idle_brightness":
-            value = int(msg)
-            self.idle_brightness_cb(value)
-        elif key == b"max_brightness":
-            value = int(msg)
-            self.animation["level_max"] = max(min(value, 4095), 0)
-            self.client.publish(brightness_state_topic, str(self.animation["level_max"]))
-        elif key == b"edge_glow":
-            value = int(msg)
-            self.edge_glow_cb(value)
-        elif key == b"animation_duration":
-            value = int(msg)
-            self.animation["duration"] = min(max(value, 1), 60)
-        elif key == b"animation_pause":
-            value = int(msg)
-            self.animation["pause_time"] = min(max(value, 1), 600)
-        print("Set", key, "to", value)
-
-    def handle_command(self, msg):
-        self.enabled_state_cb(msg == b"ON")
-        self.client.publish(state_topic, msg)
-
-    def handle_brightness_command(self, msg):
-        value = int(msg)
-        self.animation["level_max"] = max(min(value, 4095), 0)
-        self.client.publish(brightness_state_topic, str(value))
+    def handle_command(self, value):
+        if value not in ("ON", "OFF"):
+            raise ValueError("state must be ON or OFF")
+        self.enabled_state_cb(value == "ON")
+
+    def handle_brightness_command(self, value):
+        if value != self.animation.level_max:
+            self.animation.level_max = value
+            self.animation_changed_cb()
 
     def get_current_effect_name(self):
-        return self.all_animations[self.animation["effect"]][2]
-
-    def handle_effect_command(self, msg):
-        print("Received effect command", msg)
-        for key, value in self.all_animations.items():
-            if value[2] == msg:
-                self.animation["effect"] = key
-                self.client.publish(effect_state_topic, msg)
-                return
-
-        # got unknown effect request, report back current effect
-        self.client.publish(effect_state_topic, self.get_current_effect_name())
+        return self.all_animations[self.animation.effect][2]
+
+    def handle_effect_command(self, name):
+        print("Received effect command", name)
+        key = self._effects.get(name)
+        if key is not None and key != self.animation.effect:
+            self.animation.effect = key
+            self.animation_changed_cb()
+        # unknown effect, the state publish reports back the current one
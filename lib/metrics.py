@@ -0,0 +1,126 @@
+# Lightweight runtime metrics: counters and fixed-bucket histograms in preallocated storage.
+# Modules record into the shared `metrics` instance, Hass publishes a snapshot periodically
+# as one compact JSON diagnostics document.
+# Imported before the first frame (lib/output.py records into it), so asyncio and gc are
+# only imported once monitor() runs.
+
+import time
+from array import array
+
+
+# keeps Histogram.total a small int (30 bits on the ESP32 port) however long it goes
+# without a snapshot, so recording a value never allocates
+TOTAL_MAX = 1 << 28
+
+
+class Histogram:
+    def __init__(self, bounds):
+        # ascending upper bucket bounds, values above the last one land in an overflow bucket
+        self.bounds = bounds
+        self.counts = array("I", [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        i = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if self.total > TOTAL_MAX:
+            # halving both keeps the average
+            self.total >>= 1
+            self.count >>= 1
+        if value > self.max:
+            self.max = value
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def snapshot(self):
+        return {
+            "le": self.bounds,
+            "n": list(self.counts),
+            "avg": self.total // self.count if self.count else 0,
+            "max": self.max,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        # lowest gc.mem_free() seen
+        self.mem_free_min = -1
+        # ticks_ms of the trigger still waiting for its first frame
+        self._trigger_ms = None
+
+    def counter(self, name):
+        self.counters[name] = 0
+
+    def incr(self, name, n=1):
+        self.counters[name] += n
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def histogram(self, name, bounds):
+        self.histograms[name] = Histogram(bounds)
+
+    def observe(self, name, value):
+        self.histograms[name].add(value)
+
+    def trigger(self):
+        if self._trigger_ms is None:
+            self._trigger_ms = time.ticks_ms()
+
+    def frame_committed(self):
+        if self._trigger_ms is not None:
+            self.observe("trigger_to_frame_ms", time.ticks_diff(time.ticks_ms(), self._trigger_ms))
+            self._trigger_ms = None
+
+    async def monitor(self, interval_ms=1000):
+        # event loop lag is how late the sleep returns, sampled rarely to keep idle wakeups low
+        import asyncio
+        import gc
+
+        while True:
+            start = time.ticks_ms()
+            await asyncio.sleep_ms(interval_ms)
+            self.observe("loop_lag_ms", max(time.ticks_diff(time.ticks_ms(), start) - interval_ms, 0))
+            free = gc.mem_free()
+            if self.mem_free_min < 0 or free < self.mem_free_min:
+                self.mem_free_min = free
+
+    def snapshot(self, reset=True):
+        # histograms cover the time since the last snapshot, counters are cumulative
+        data = {"mem_free_min": self.mem_free_min}
+        for name, value in self.counters.items():
+            data[name] = value
+        for name, histogram in self.histograms.items():
+            data[name] = histogram.snapshot()
+            if reset:
+                histogram.reset()
+        return data
+
+
+metrics = Metrics()
+metrics.histogram("frame_us", (1000, 2000, 5000, 10000, 20000, 50000))
+metrics.histogram("i2c_write_us", (200, 500, 1000, 2000, 5000))
+metrics.histogram("loop_lag_ms", (1, 5, 10, 50, 100, 500))
+metrics.histogram("mqtt_rtt_ms", (10, 50, 100, 500, 1000))
+metrics.histogram("trigger_to_frame_ms", (5, 10, 20, 50, 100, 500))
+metrics.counter("frames")
+metrics.counter("i2c_writes")
+metrics.counter("mqtt_connects")
+metrics.counter("mqtt_rx")
+metrics.counter("mqtt_tx")
+metrics.counter("triggers")
@@ -0,0 +1,232 @@
+# Minimal asyncio MQTT 3.1.1 client (QoS 0 only).
+# Incoming packets are read as they arrive, outgoing publishes are queued and sent by a
+# writer task, and a dropped connection is re-established in the background with backoff,
+# so the event loop (and running animations) never blocks on the broker.
+
+import asyncio
+import time
+from ustruct import pack
+from lib.metrics import metrics
+
+# reconnect backoff bounds
+BACKOFF_MIN_MS = 1000
+BACKOFF_MAX_MS = 60000
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=1883, user=None, password=None, keepalive=60, queue_size=16):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self._queue_size = queue_size
+        # pending (topic, msg, retain) publishes, oldest dropped when full
+        self._queue = []
+        self._topics = []
+        self._cb = None
+        self._connect_cb = None
+        self._reader = None
+        self._writer = None
+        self._connected = False
+        self._pid = 0
+        self._pong = True
+        self._ping_ms = 0
+        # PINGREQ waiting for the writer task, the only one writing the stream while connected
+        self._ping = False
+        self._send = asyncio.Event()
+        # set by the read, write or keepalive loop when the connection is gone
+        self._lost = asyncio.Event()
+
+    def set_callback(self, cb):
+        self._cb = cb
+
+    # called after every (re)connect, once subscriptions are sent
+    def set_connect_callback(self, cb):
+        self._connect_cb = cb
+
+    def isconnected(self):
+        return self._connected
+
+    def subscribe(self, topic):
+        # (re)subscribed on every connect
+        self._topics.append(topic)
+
+    def publish(self, topic, msg, retain=False):
+        if isinstance(msg, str):
+            msg = msg.encode()
+        if len(self._queue) >= self._queue_size:
+            self._queue.pop(0)
+        self._queue.append((topic, msg, retain))
+        self._send.set()
+
+    async def run(self):
+        backoff = BACKOFF_MIN_MS
+        while True:
+            try:
+                await self._connect()
+                backoff = BACKOFF_MIN_MS
+                self._connected = True
+                metrics.incr("mqtt_connects")
+                print("Connected to MQTT broker")
+                if self._connect_cb is not None:
+                    self._connect_cb()
+                await self._serve()
+            except Exception as e:
+                print("MQTT connection lost:", e)
+            self._connected = False
+            await self._close()
+            print("MQTT reconnecting in", backoff, "ms")
+            await asyncio.sleep_ms(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX_MS)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.server, self.port), 10)
+
+        flags = 0x02  # clean session
+        body = b"\x00\x04MQTT\x04"
+        payload = self._str(self.client_id)
+        if self.user is not None:
+            flags |= 0x80
+            payload += self._str(self.user)
+        if self.password is not None:
+            flags |= 0x40
+            payload += self._str(self.password)
+        await self._write_packet(0x10, body + pack("!BH", flags, self.keepalive) + payload)
+
+        ptype, body = await asyncio.wait_for(self._read_packet(), 10)
+        if ptype != 0x20 or body[1] != 0:
+            raise OSError("CONNACK failed")
+
+        if self._topics:
+            body = pack("!H", self._next_pid())
+            for topic in self._topics:
+                body += self._str(topic) + b"\x00"
+            await self._write_packet(0x82, body)
+
+    async def _serve(self):
+        # returns once any of the loops gives up on the connection, the others are cancelled
+        # since a half-open socket would keep a read or drain waiting forever
+        self._pong = True
+        self._ping = False
+        self._lost.clear()
+        tasks = (
+            asyncio.create_task(self._read_loop()),
+            asyncio.create_task(self._write_loop()),
+            asyncio.create_task(self._keepalive_loop()),
+        )
+        try:
+            await self._lost.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                ptype, body = await self._read_packet()
+                if ptype & 0xF0 == 0x30:
+                    self._handle_publish(ptype, body)
+                elif ptype == 0xD0:
+                    self._pong = True
+                    metrics.observe("mqtt_rtt_ms", time.ticks_diff(time.ticks_ms(), self._ping_ms))
+        except Exception as e:
+            print("MQTT read failed:", e)
+            self._lost.set()
+
+    def _handle_publish(self, ptype, body):
+        topic_len = (body[0] << 8) | body[1]
+        topic = body[2 : 2 + topic_len]
+        pos = 2 + topic_len
+        # QoS > 0 carries a packet id
+        if ptype & 0x06:
+            pos += 2
+        metrics.incr("mqtt_rx")
+        if self._cb is None:
+            return
+        try:
+            self._cb(topic, body[pos:])
+        except Exception as e:
+            print("MQTT callback failed:", e)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if self._ping:
+                    self._ping = False
+                    self._ping_ms = time.ticks_ms()
+                    await self._write_packet(0xC0, b"")
+                elif self._queue:
+                    topic, msg, retain = self._queue[0]
+                    await self._write_packet(0x31 if retain else 0x30, self._str(topic) + msg)
+                    self._queue.pop(0)
+                    metrics.incr("mqtt_tx")
+                else:
+                    self._send.clear()
+                    await self._send.wait()
+        except Exception as e:
+            print("MQTT write failed:", e)
+            self._lost.set()
+
+    async def _keepalive_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive // 2)
+            if not self._pong:
+                print("MQTT ping timeout")
+                self._lost.set()
+                return
+            self._pong = False
+            # sent by the write loop, two tasks draining one stream trips MicroPython's asyncio
+            self._ping = True
+            self._send.set()
+
+    async def _read_packet(self):
+        reader = self._reader
+        ptype = (await reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            digit = (await reader.readexactly(1))[0]
+            length |= (digit & 0x7F) << shift
+            shift += 7
+            if not digit & 0x80:
+                break
+        body = await reader.readexactly(length) if length else b""
+        return ptype, body
+
+    async def _write_packet(self, ptype, body):
+        header = bytearray(5)
+        header[0] = ptype
+        length = len(body)
+        i = 1
+        while True:
+            digit = length & 0x7F
+            length >>= 7
+            header[i] = digit | 0x80 if length else digit
+            i += 1
+            if not length:
+                break
+        self._writer.write(header[:i])
+        self._writer.write(body)
+        await self._writer.drain()
+
+    def _next_pid(self):
+        self._pid = self._pid % 0xFFFF + 1
+        return self._pid
+
+    def _str(self, s):
+        if isinstance(s, str):
+            s = s.encode()
+        return pack("!H", len(s)) + s
+
+    async def _close(self):
+        # MicroPython's Stream.close() does nothing, the socket is only closed by wait_closed()
+        if self._writer is not None:
+            try:
+                self._writer.close()
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = None
+        self._writer = None
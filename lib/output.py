@@ -0,0 +1,278 @@
+# output drivers: stage(index, value) only records the level, commit() sends out whatever
+# changed since the last commit the cheapest way the hardware allows
+#
+# ChannelOutput is a driver too, it mirrors all channel values in memory, drops unchanged
+# values and routes the rest through the gamma table to the drivers of the channel map
+
+import time
+from array import array
+from lib.metrics import metrics
+from lib.pca9685 import PCA9685, ALL_CALL_ADDRESS
+
+
+def _bus_bytes(mask):
+    # bytes on the bus to write the channels in mask as coalesced runs, each run costs the
+    # device and register address plus 4 bytes per channel
+    cost = 0
+    while mask:
+        if mask & 1:
+            cost += 4
+            if not mask & 2:
+                cost += 2
+        mask >>= 1
+    return cost
+
+
+class PCA9685Driver:
+    # boards: PCA9685 boards on one bus, channels follow board by board, counts: channels
+    # used per board (16 by default), all_call: only if no other board is on the bus
+    def __init__(self, boards, counts=None, all_call=False):
+        if counts is None:
+            counts = [16] * len(boards)
+        self.boards = boards
+        self.count = sum(counts)
+        self.values = array("H", [0] * self.count)
+        # first channel per board, channel -> board, channel -> index on that board
+        self._base = array("H", [0] * len(boards))
+        self._size = bytearray(counts)
+        self._board = bytearray(self.count)
+        self._local = bytearray(self.count)
+        channel = 0
+        for b, count in enumerate(counts):
+            self._base[b] = channel
+            for n in range(count):
+                self._board[channel] = b
+                self._local[channel] = n
+                channel += 1
+        # per board, bit n set -> channel n changed since last commit, start with everything
+        # dirty since we don't know what the hardware currently shows
+        self._dirty = array("H", [(1 << count) - 1 for count in counts])
+        # every board answers ALL_CALL, so it's only safe when all of them drive all 16 channels
+        self._all_call = all_call and len(boards) > 1
+        for count in counts:
+            if count != 16:
+                self._all_call = False
+        self.writes_issued = 0
+
+    def stage(self, index, value):
+        # after gamma several levels share a duty, most of all at the low end
+        if self.values[index] == value:
+            return
+        self.values[index] = value
+        self._dirty[self._board[index]] |= 1 << self._local[index]
+
+    def commit(self):
+        dirty = self._dirty
+        if self._all_call and self._boards_match():
+            # one frame to every board at once, they also switch over in sync
+            self._flush_board(0, 0xFFFF, ALL_CALL_ADDRESS)
+            for b in range(len(dirty)):
+                dirty[b] = 0
+            return
+
+        for b in range(len(dirty)):
+            mask = dirty[b]
+            if not mask:
+                continue
+            dirty[b] = 0
+            self._flush_board(b, mask, None)
+
+    def _flush_board(self, b, mask, address):
+        board = self.boards[b]
+        base = self._base[b]
+        size = self._size[b]
+        values = self.values
+        # mostly uniform frames (breathe, edge glow on top of idle) are cheaper as one
+        # ALL_LED write plus the channels that differ from it
+        level = values[base + size // 2]
+        others = 0
+        for n in range(size):
+            if values[base + n] != level:
+                others |= 1 << n
+        if _bus_bytes(others) + 6 < _bus_bytes(mask):
+            write_start_us = time.ticks_us()
+            board.all_duty(level, address=address)
+            self._written(write_start_us)
+            mask = others
+
+        # coalesce adjacent dirty channels into one auto-increment write
+        index = 0
+        while mask:
+            while not mask & 1:
+                mask >>= 1
+                index += 1
+            start = index
+            while mask & 1:
+                mask >>= 1
+                index += 1
+            write_start_us = time.ticks_us()
+            board.write_frame(values, start, index - start, base, address=address)
+            self._written(write_start_us)
+
+    def _written(self, write_start_us):
+        metrics.observe("i2c_write_us", time.ticks_diff(time.ticks_us(), write_start_us))
+        metrics.incr("i2c_writes")
+        self.writes_issued += 1
+
+    def _boards_match(self):
+        # true if some board changed and every board shows the same 16 values
+        values = self.values
+        dirty = self._dirty
+        changed = False
+        for b in range(len(dirty)):
+            if dirty[b]:
+                changed = True
+                break
+        if not changed:
+            return False
+        for other in range(16, self.count, 16):
+            for n in range(16):
+                if values[n] != values[other + n]:
+                    return False
+        return True
+
+
+class PWMDriver:
+    # native machine.PWM pin, one channel, 12 bit levels scaled to duty_u16
+    def __init__(self, pwm):
+        self.pwm = pwm
+        self.count = 1
+        self.value = 0
+        self._dirty = True
+        self.writes_issued = 0
+
+    def stage(self, index, value):
+        self.value = value
+        self._dirty = True
+
+    def commit(self):
+        if self._dirty:
+            self._dirty = False
+            self.pwm.duty_u16(16 * self.value)
+            self.writes_issued += 1
+
+
+class RecordingDriver:
+    # keeps a copy of every committed frame, for the host benchmarks and simulations
+    def __init__(self, count):
+        self.count = count
+        self.values = array("H", [0] * count)
+        self.frames = []
+        self.writes_issued = 0
+
+    def stage(self, index, value):
+        self.values[index] = value
+
+    def commit(self):
+        self.frames.append(array("H", self.values))
+        self.writes_issued += 1
+
+
+class NullDriver:
+    # drops everything, to measure the effects without any bus time
+    def __init__(self, count):
+        self.count = count
+        self.writes_issued = 0
+
+    def stage(self, index, value):
+        pass
+
+    def commit(self):
+        pass
+
+
+def drivers_from_config(i2c, outputs, freq=1000):
+    # outputs: channel map entries in channel order, consecutive PCA9685 boards share a driver
+    from machine import Pin, PWM
+
+    groups = 0
+    for n, entry in enumerate(outputs):
+        if entry["type"] == "pca9685" and (n == 0 or outputs[n - 1]["type"] != "pca9685"):
+            groups += 1
+
+    drivers = []
+    boards = []
+    counts = []
+    for entry in outputs:
+        kind = entry["type"]
+        if kind == "pca9685":
+            boards.append(PCA9685(i2c, address=entry["address"], freq=freq))
+            counts.append(entry.get("channels", 16))
+            continue
+        if boards:
+            drivers.append(PCA9685Driver(boards, counts, all_call=groups == 1))
+            boards = []
+            counts = []
+        if kind == "pwm":
+            drivers.append(PWMDriver(PWM(Pin(entry["pin"]), freq=2000, duty=0)))
+        elif kind == "recording":
+            drivers.append(RecordingDriver(entry["channels"]))
+        else:
+            drivers.append(NullDriver(entry["channels"]))
+    if boards:
+        drivers.append(PCA9685Driver(boards, counts, all_call=groups == 1))
+    return drivers
+
+
+class ChannelOutput:
+    # table: level -> duty lookup (see lib/gamma.py), values and get() stay in levels
+    def __init__(self, drivers, table):
+        self.drivers = drivers
+        self.table = table
+        self.count = sum(driver.count for driver in drivers)
+        self.values = array("H", [0] * self.count)
+        # channel -> driver, channel -> index on that driver
+        self._driver = bytearray(self.count)
+        self._local = bytearray(self.count)
+        channel = 0
+        for d, driver in enumerate(drivers):
+            for n in range(driver.count):
+                self._driver[channel] = d
+                self._local[channel] = n
+                channel += 1
+        # bit d set -> driver d has staged values, start with everything pending since we
+        # don't know what the hardware currently shows
+        self._pending = (1 << len(drivers)) - 1
+        # channel updates dropped because the value didn't change
+        self.writes_skipped = 0
+
+    def stage(self, index, value):
+        if self.values[index] == value:
+            self.writes_skipped += 1
+            return
+        self.values[index] = value
+        d = self._driver[index]
+        self.drivers[d].stage(self._local[index], self.table[value])
+        self._pending |= 1 << d
+
+    def restage(self):
+        # sends every channel through the table again, after it changed
+        values = self.values
+        table = self.table
+        for index in range(self.count):
+            self.drivers[self._driver[index]].stage(self._local[index], table[values[index]])
+        self._pending = (1 << len(self.drivers)) - 1
+
+    def get(self, index):
+        return self.values[index]
+
+    def commit(self):
+        pending = self._pending
+        self._pending = 0
+        d = 0
+        while pending:
+            if pending & 1:
+                self.drivers[d].commit()
+            pending >>= 1
+            d += 1
+
+    def writes_issued(self):
+        # bus writes actually performed, one per contiguous PCA run or ALL_CALL frame and one
+        # per PWM update
+        issued = 0
+        for driver in self.drivers:
+            issued += driver.writes_issued
+        return issued
+
+    def stats(self):
+        return {"issued": self.writes_issued(), "skipped": self.writes_skipped}
@@ -3,12 +3,25 @@
 import ustruct
 import time
 
+# every board answers on this address as well while MODE1 ALLCALL is set (see init())
+ALL_CALL_ADDRESS = 0x70
+
 
 class PCA9685:
-    def __init__(self, i2c, address=0x40):
+    def __init__(self, i2c, address=0x40, freq=None):
         self.i2c = i2c
         self.address = address
-        self.reset()
+        # LEDn_ON_L..LEDn_OFF_H for all 16 channels, written in one go with auto-increment
+        self._frame = bytearray(64)
+        # preallocated views for writing the first n channel slots, so partial writes don't allocate
+        frame = memoryview(self._frame)
+        self._views = [frame[: 4 * n] for n in range(17)]
+        # ALL_LED_ON_L..ALL_LED_OFF_H
+        self._all = bytearray(4)
+        if freq is None:
+            self.reset()
+        else:
+            self.init(freq)
 
     def _write(self, address, value):
         self.i2c.writeto_mem(self.address, address, bytearray([value]))
@@ -19,6 +32,15 @@ class PCA9685:
     def reset(self):
         self._write(0x00, 0x00)  # Mode 1
 
+    def init(self, freq):
+        # boot path: same end state as reset() + freq(), but write-only with known mode values
+        # instead of read-modify-write
+        self._write(0x00, 0x31)  # Mode 1, sleep, autoincrement, all call
+        self._write(0xFE, int(25000000.0 / 4096.0 / freq + 0.5))  # Prescale
+        self._write(0x00, 0x21)  # Mode 1, wake
+        time.sleep_us(500)  # oscillator start up
+        self._write(0x00, 0xA1)  # Mode 1, restart, autoincrement on
+
     def freq(self, freq=None):
         if freq is None:
             return int(25000000.0 / 4096 / (self._read(0xFE) - 0.5))
@@ -59,3 +81,50 @@ class PCA9685:
             self.pwm(index, 4096, 0)
         else:
             self.pwm(index, 0, value)
+
+    def write_frame(self, values, start=0, count=16, base=0, invert=False, address=None):
+        # requires auto-increment (set in freq()), writes channels start..start + count - 1
+        # from values[base + start:] in a single transaction
+        # address=ALL_CALL_ADDRESS sends the same frame to every board at once
+        buf = self._frame
+        for n in range(count):
+            value = values[base + start + n]
+            if not 0 <= value <= 4095:
+                raise ValueError("Out of range")
+            if invert:
+                value = 4095 - value
+            offset = 4 * n
+            if value == 0:
+                on, off = 0, 4096
+            elif value == 4095:
+                on, off = 4096, 0
+            else:
+                on, off = 0, value
+            buf[offset] = on & 0xFF
+            buf[offset + 1] = on >> 8
+            buf[offset + 2] = off & 0xFF
+            buf[offset + 3] = off >> 8
+        if address is None:
+            address = self.address
+        self.i2c.writeto_mem(address, 0x06 + 4 * start, self._views[count])
+
+    def all_duty(self, value, invert=False, address=None):
+        # sets all 16 channels in one 4 byte write to the ALL_LED registers
+        if not 0 <= value <= 4095:
+            raise ValueError("Out of range")
+        if invert:
+            value = 4095 - value
+        if value == 0:
+            on, off = 0, 4096
+        elif value == 4095:
+            on, off = 4096, 0
+        else:
+            on, off = 0, value
+        buf = self._all
+        buf[0] = on & 0xFF
+        buf[1] = on >> 8
+        buf[2] = off & 0xFF
+        buf[3] = off >> 8
+        if address is None:
+            address = self.address
+        self.i2c.writeto_mem(address, 0xFA, buf)
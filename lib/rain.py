@@ -0,0 +1,50 @@
+# Streams packed frame files (written by noise.py on the host) row by row from flash,
+# so a sequence of any length costs one row buffer of RAM.
+#
+# file layout: 8 byte header followed by fixed size rows
+#   "<2sBBHH": magic b"NZ", bits per value (12 or 8), channels, rows, reserved
+# 12 bit rows pack channel pairs a, b into three bytes: low byte of a, then high nibble
+# of a | low nibble of b << 4, then high byte of b; 8 bit rows hold value >> 4
+
+from ustruct import unpack
+
+HEADER = "<2sBBHH"
+HEADER_SIZE = 8
+
+
+class PackedFrames:
+    def __init__(self, path):
+        self._f = open(path, "rb")
+        magic, bits, channels, rows, _ = unpack(HEADER, self._f.read(HEADER_SIZE))
+        if magic != b"NZ" or bits not in (8, 12):
+            self._f.close()
+            raise ValueError("Not a packed frame file")
+        self.bits = bits
+        self.channels = channels
+        self.rows = rows
+        self.row_size = (channels * 3 + 1) // 2 if bits == 12 else channels
+        self._row = bytearray(self.row_size)
+        # decoded values of the last read row
+        self.values = [0] * channels
+
+    def read_row(self, row):
+        f = self._f
+        f.seek(HEADER_SIZE + row * self.row_size)
+        f.readinto(self._row)
+        buf = self._row
+        values = self.values
+        if self.bits == 8:
+            for i in range(self.channels):
+                value = buf[i]
+                values[i] = (value << 4) | (value >> 4)
+            return values
+        for i in range(self.channels):
+            offset = (i >> 1) * 3
+            if i & 1:
+                values[i] = (buf[offset + 1] >> 4) | (buf[offset + 2] << 4)
+            else:
+                values[i] = buf[offset] | ((buf[offset + 1] & 0x0F) << 8)
+        return values
+
+    def close(self):
+        self._f.close()
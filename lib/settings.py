@@ -0,0 +1,143 @@
+# Light settings persisted to flash as a small binary record, restored on boot before
+# the first frame so the stairs don't run on defaults until Home Assistant shows up.
+# Changes are coalesced: the record is written once settings have been quiet for a while,
+# and only if it differs from what's already in flash.
+
+from ustruct import pack, unpack, calcsize
+
+PATH = "settings.bin"
+# magic, version, on, level_min, level_max, edge_glow, duration, pause_time, effect, gamma,
+# checksum
+RECORD = "<2sBBHHHHH16sBB"
+RECORD_SIZE = calcsize(RECORD)
+MAGIC = b"ST"
+VERSION = 1
+
+# write after this long without further changes, but no later than SAVE_MAX_DELAY_MS
+SAVE_DELAY_MS = 5000
+SAVE_MAX_DELAY_MS = 60000
+
+
+def _checksum(data):
+    total = 0
+    for b in data:
+        total += b
+    return total & 0xFF
+
+
+def _clamp(value, low, high):
+    return min(max(value, low), high)
+
+
+class Settings:
+    def __init__(self, state, animation, path=PATH):
+        self.state = state
+        self.animation = animation
+        self.path = path
+        # record currently in flash
+        self._saved = None
+        # created by run(), asyncio isn't needed (or imported) before the first frame
+        self._changed = None
+
+    def _record(self):
+        s = self.state
+        a = self.animation
+        data = pack(
+            RECORD[:-1],
+            MAGIC,
+            VERSION,
+            1 if s.on else 0,
+            a.level_min,
+            a.level_max,
+            a.edge_glow,
+            a.duration,
+            a.pause_time,
+            a.effect.encode(),
+            a.gamma,
+        )
+        return data + bytes((_checksum(data),))
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read(RECORD_SIZE)
+        except OSError:
+            return False
+        try:
+            on, level_min, level_max, edge_glow, duration, pause_time, effect, gamma = self._parse(data)
+        except (ValueError, UnicodeError) as e:
+            # never keep the stairs dark over a bad record, it's rewritten with the next save
+            print("Settings record corrupt, using defaults:", e)
+            return False
+        s = self.state
+        a = self.animation
+        s.on = on
+        a.level_max = level_max
+        a.level_min = level_min
+        a.edge_glow = edge_glow
+        a.duration = duration
+        a.pause_time = pause_time
+        a.effect = effect
+        a.gamma = gamma
+        self._saved = data
+        print("Settings restored")
+        return True
+
+    def _parse(self, data):
+        # raises ValueError (or UnicodeError) unless it's an intact record, fields are clamped
+        # to the same bounds as the Hass properties
+        if len(data) != RECORD_SIZE or data[-1] != _checksum(data[:-1]):
+            raise ValueError("bad size or checksum")
+        magic, version, on, level_min, level_max, edge_glow, duration, pause_time, effect, gamma, _ = unpack(
+            RECORD, data
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unknown record version")
+        level_max = _clamp(level_max, 0, 4095)
+        return (
+            bool(on),
+            # idle and edge glow never above the animation maximum, like the Hass callbacks
+            _clamp(level_min, 0, level_max),
+            level_max,
+            _clamp(edge_glow, 0, level_max),
+            _clamp(duration, 1, 60),
+            _clamp(pause_time, 1, 600),
+            effect.rstrip(b"\x00").decode(),
+            _clamp(gamma, 0, 30),
+        )
+
+    def write(self):
+        data = self._record()
+        if data == self._saved:
+            return
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self._saved = data
+        print("Settings saved")
+
+    def save(self):
+        # mark changed, the run() task does the actual (coalesced) write
+        if self._changed is not None:
+            self._changed.set()
+
+    async def run(self):
+        import asyncio
+        import time
+
+        self._changed = asyncio.Event()
+        while True:
+            await self._changed.wait()
+            first_change = time.ticks_ms()
+            while True:
+                self._changed.clear()
+                delay = min(SAVE_DELAY_MS, SAVE_MAX_DELAY_MS - time.ticks_diff(time.ticks_ms(), first_change))
+                if delay <= 0:
+                    break
+                try:
+                    await asyncio.wait_for_ms(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    break
+            try:
+                self.write()
+            except OSError as e:
+                print("Failed to save settings:", e)
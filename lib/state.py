@@ -0,0 +1,63 @@
+# Runtime state shared by main.py, Animations and Hass.
+# Slotted objects instead of string-keyed dicts, phases are small ints.
+
+from array import array
+
+# animation phases
+IDLE = 0
+ANIMATE_IN = 1
+PAUSE = 2
+ANIMATE_OUT = 3
+# trigger during animate_out, go straight back to animate_in
+OVERRIDE = 4
+
+PHASE_NAMES = ("idle", "animate_in", "pause", "animate_out", "override")
+
+
+class AnimationConfig:
+    __slots__ = ("level_min", "level_max", "edge_glow", "duration", "pause_time", "effect", "gamma")
+
+    def __init__(self):
+        self.level_min = 0
+        self.level_max = 4095
+        self.edge_glow = 120
+        # seconds
+        self.duration = 2
+        self.pause_time = 15
+        # all_animations key
+        self.effect = "breathe"
+        # output curve in tenths, 10 is linear, 0 is CIE lightness, see lib/gamma.py
+        self.gamma = 10
+
+
+class AnimationState:
+    __slots__ = ("on", "phase", "forward", "animate_in", "pause_until")
+
+    def __init__(self):
+        self.on = True
+        self.phase = IDLE
+        self.forward = True
+        # animate in requested
+        self.animate_in = False
+        # ticks_ms deadline of the pause between animating in and out
+        self.pause_until = 0
+
+
+class ChannelBuffer:
+    __slots__ = ("count", "values", "low")
+
+    def __init__(self, values):
+        self.count = len(values)
+        # current channel values, mirrored because it's slow to read from PCA9685
+        self.values = values
+        # idle channel values (to accommodate edge glow)
+        self.low = array("H", [0] * self.count)
+
+    def update_low(self, level_min, edge_glow):
+        # filled in place, no reallocation when idle brightness or edge glow change
+        low = self.low
+        for i in range(self.count):
+            low[i] = level_min
+        if edge_glow > level_min:
+            low[0] = edge_glow
+            low[self.count - 1] = edge_glow
@@ -0,0 +1,74 @@
+# Interrupt driven replacement for Pushbutton for the stair sensors.
+# Nothing runs while the sensors are idle: a pin edge interrupt sets a ThreadSafeFlag
+# and the task debounces by timestamp of the last accepted state change.
+
+import asyncio
+from machine import Pin
+from time import ticks_ms, ticks_diff
+from lib.primitives.init import launch
+
+
+class Trigger:
+    debounce_ms = 50
+
+    def __init__(self, pin, sense=None):
+        self._pin = pin
+        self._tf = False
+        self._ta = ()
+        self._ff = False
+        self._fa = ()
+        # Convert from electrical to logical value
+        self._sense = pin.value() if sense is None else sense
+        self._state = self.rawstate()
+        # time of the last accepted state change
+        self._changed_ms = ticks_ms()
+        self._flag = asyncio.ThreadSafeFlag()
+        self._run = asyncio.create_task(self._go())
+        pin.irq(handler=self._irq, trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING)
+
+    def _irq(self, pin):
+        # may run as a hard ISR, don't allocate
+        self._flag.set()
+
+    async def _go(self):
+        while True:
+            await self._flag.wait()
+            # act on the first edge right away, then ignore bounces until the debounce
+            # window has passed and re-read the pin in case it settled the other way
+            while True:
+                state = self.rawstate()
+                if state == self._state:
+                    break
+                self._state = state
+                self._changed_ms = ticks_ms()
+                if state:
+                    if self._tf:
+                        launch(self._tf, self._ta)
+                elif self._ff:
+                    launch(self._ff, self._fa)
+                await asyncio.sleep_ms(Trigger.debounce_ms - ticks_diff(ticks_ms(), self._changed_ms))
+
+    # ****** API ******
+    def press_func(self, func=False, args=()):
+        if func is None:
+            self.press = asyncio.Event()
+        self._tf = self.press.set if func is None else func
+        self._ta = args
+
+    def release_func(self, func=False, args=()):
+        if func is None:
+            self.release = asyncio.Event()
+        self._ff = self.release.set if func is None else func
+        self._fa = args
+
+    # Current non-debounced logical state: True == triggered
+    def rawstate(self):
+        return bool(self._pin() ^ self._sense)
+
+    # Current debounced state (True == triggered)
+    def __call__(self):
+        return self._state
+
+    def deinit(self):
+        self._pin.irq(handler=None)
+        self._run.cancel()
@@ -0,0 +1,134 @@
+# Wi-Fi connection manager.
+# Joins straight to the BSSID/channel cached from the last good connection (no scan),
+# falls back to a scan for the strongest AP with our SSID, optionally skips DHCP with a
+# static IP from config ("static_ip": [ip, netmask, gateway, dns]), and rejoins in the
+# background when the link drops. WLAN.scan() blocks the event loop for seconds, so only
+# the boot join scans, background rejoins let the driver pick the AP.
+
+import asyncio
+import time
+import network
+from lib.metrics import metrics
+
+CACHE_PATH = "wifi.bin"
+FAST_JOIN_TIMEOUT_MS = 3000
+FULL_JOIN_TIMEOUT_MS = 20000
+POLL_MS = 50
+SUPERVISE_INTERVAL_MS = 5000
+
+metrics.counter("wifi_connect_ms")
+metrics.counter("wifi_reconnects")
+
+
+class WiFi:
+    def __init__(self, ssid, password, static_ip=None, cache_path=CACHE_PATH):
+        self.ssid = ssid
+        self.password = password
+        self.static_ip = tuple(static_ip) if static_ip else None
+        self.cache_path = cache_path
+        self.sta = network.WLAN(network.STA_IF)
+        # "fast" or "full", how the last join went
+        self.last_join = None
+
+    def isconnected(self):
+        return self.sta.isconnected()
+
+    def _load_cache(self):
+        # 6 bytes BSSID + 1 byte channel
+        try:
+            with open(self.cache_path, "rb") as f:
+                data = f.read(7)
+        except OSError:
+            return None
+        if len(data) != 7:
+            return None
+        return data[:6], data[6]
+
+    def _save_cache(self, bssid, channel):
+        try:
+            with open(self.cache_path, "wb") as f:
+                f.write(bytes(bssid) + bytes((channel,)))
+        except OSError as e:
+            print("Failed to cache Wi-Fi AP:", e)
+
+    async def _join(self, bssid, channel, timeout_ms):
+        sta = self.sta
+        if channel:
+            try:
+                sta.config(channel=channel)
+            except (OSError, ValueError):
+                pass
+        # the driver raises while it's busy reconnecting on its own
+        try:
+            if bssid:
+                sta.connect(self.ssid, self.password, bssid=bssid)
+            else:
+                sta.connect(self.ssid, self.password)
+            start = time.ticks_ms()
+            while not sta.isconnected():
+                if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                    sta.disconnect()
+                    return False
+                await asyncio.sleep_ms(POLL_MS)
+        except OSError as e:
+            print("Wi-Fi join failed:", e)
+            return False
+        return True
+
+    def _scan(self):
+        # strongest AP advertising our SSID
+        best = None
+        ssid = self.ssid.encode()
+        try:
+            found = self.sta.scan()
+        except OSError as e:
+            print("Wi-Fi scan failed:", e)
+            return None
+        for found_ssid, bssid, channel, rssi, _, _ in found:
+            if found_ssid == ssid and (best is None or rssi > best[2]):
+                best = (bssid, channel, rssi)
+        return best
+
+    # scan: look for the strongest AP if the cached one is gone, boot only
+    async def connect(self, scan=True):
+        sta = self.sta
+        ap_if = network.WLAN(network.AP_IF)
+        if ap_if.active():
+            ap_if.active(False)
+        if sta.isconnected():
+            return True
+
+        start = time.ticks_ms()
+        print("Connecting to network...")
+        sta.active(True)
+        if self.static_ip:
+            sta.ifconfig(self.static_ip)
+
+        cached = self._load_cache()
+        if cached and await self._join(cached[0], cached[1], FAST_JOIN_TIMEOUT_MS):
+            self.last_join = "fast"
+        else:
+            best = None
+            if scan:
+                if cached:
+                    print("Cached AP unavailable, scanning")
+                best = self._scan()
+            if best is not None and await self._join(best[0], best[1], FULL_JOIN_TIMEOUT_MS):
+                self._save_cache(best[0], best[1])
+            elif not await self._join(None, 0, FULL_JOIN_TIMEOUT_MS):
+                print("Network connection failed")
+                return False
+            self.last_join = "full"
+
+        connect_ms = time.ticks_diff(time.ticks_ms(), start)
+        metrics.set("wifi_connect_ms", connect_ms)
+        print("Network config:", sta.ifconfig(), self.last_join, "join took", connect_ms, "ms")
+        return True
+
+    async def supervise(self):
+        while True:
+            await asyncio.sleep_ms(SUPERVISE_INTERVAL_MS)
+            if not self.sta.isconnected():
+                print("Network connection lost")
+                metrics.incr("wifi_reconnects")
+                await self.connect(scan=False)
@@ -1,19 +1,33 @@
-from machine import Pin, I2C, PWM
-import asyncio
-import gc
-from ujson import loads
-from lib.pca9685 import PCA9685
-from lib.animations import Animations
-from lib.primitives.pushbutton import Pushbutton
-from lib.hass import Hass
-
-CONFIG = loads(open("config.json").read())
+import time
+from machine import Pin, I2C
+from lib.output import ChannelOutput, drivers_from_config
+from lib.gamma import GammaTable
+from lib.compositor import Compositor, MAX, ADD
+from lib.state import AnimationConfig, AnimationState, ChannelBuffer
+from lib.settings import Settings
 
 # TODO:
 # - day and night mode based on RTC
 
+# Boot is staged so the stairs light up as early as possible: config and hardware and idle
+# levels first, then animations and triggers, and network and Home Assistant last.
+
 print("Start")
 
+CONFIG = None
+
+
+def load_config():
+    global CONFIG
+    from ujson import loads
+
+    with open("config.json") as f:
+        CONFIG = loads(f.read())
+
+
+# the channel map is needed before the first frame
+load_config()
+
 # HW config
 led_pin = Pin(2, Pin.OUT)
 trigger1_pin = Pin(14, Pin.IN, Pin.PULL_UP)
@@ -23,187 +37,211 @@ scl = Pin(22)
 
 i2c = I2C(0, scl=scl, sda=sda)
 
-pca = PCA9685(i2c, address=0x40)
-pca.freq(1000)
+# channel map, controllers in channel order: PCA9685 boards (up to 16 channels each) and
+# native PWM pins (1 channel each), default is one board at 0x40 and the PWM on pin 12,
+# "null" and "recording" entries with a channel count stand in for hardware when benchmarking
+default_outputs = [
+    {"type": "pca9685", "address": 0x40},
+    {"type": "pwm", "pin": 12},
+]
 
-# zero based channel indexes
-num_output_channels = 17
+# level -> duty curve applied to every output, linear until the settings are loaded
+gamma_table = GammaTable()
+
+output = ChannelOutput(drivers_from_config(i2c, CONFIG.get("outputs", default_outputs)), gamma_table.table)
 
-pwm0 = PWM(Pin(12), freq=2000, duty=0)
+# zero based channel indexes
+num_output_channels = output.count
 
 # end HW config
 
 last_channel = num_output_channels - 1
 
-
-# was in boot, but it takes too long and it's more important to set up HW asap
-async def wifi_connect():
-    import network
-
-    ssid = CONFIG["ssid"]
-    psk = CONFIG["ssid_password"]
-    sta_if = network.WLAN(network.STA_IF)
-    ap_if = network.WLAN(network.AP_IF)
-    if ap_if.active():
-        ap_if.active(False)
-    if not sta_if.isconnected():
-        print("Connecting to network...")
-        sta_if.active(True)
-        sta_if.connect(ssid, psk)
-        while not sta_if.isconnected():
-            await asyncio.sleep_ms(200)
-            pass
-    print("Network config:", sta_if.ifconfig())
-
-
 # animation config
-animation = {
-    "level_min": 0,
-    "level_max": 4095,
-    "edge_glow": 120,
-    "direction": "forward",
-    "duration": 2,
-    "pause_time": 15,
-    "pause_timer_ms": 15000,
-    "effect": "breathe",
-    "state": "idle",
-    "animate_in": False,
-    "animate_out": False,
-}
+animation = AnimationConfig()
 
-# mirroring channel state in local memory because it's slow to read from PCA9685
-state = {
-    "on": True,
-    # animations iterate over this
-    "active_channels": [animation["level_min"]] * num_output_channels,
-    # target channel values (to accommodate edge glow)
-    "channels_low": [animation["level_min"]] * num_output_channels,
-}
+# on/off state, every animation layer has its own phase state, see layer_states
+state = AnimationState()
 
+# last settings from flash, Home Assistant only gets told about them once it's connected
+settings = Settings(state, animation)
+settings.load()
 
-def update_state_idle_channels():
-    state["channels_low"] = [animation["level_min"]] * num_output_channels
-    if animation["edge_glow"] > animation["level_min"]:
-        state["channels_low"][0] = animation["edge_glow"]
-        state["channels_low"][-1] = animation["edge_glow"]
-
+# channels.values is what the output shows, channels.low are the idle targets
+channels = ChannelBuffer(output.values)
 
-update_state_idle_channels()
+# animation layers blended over the idle levels: one per trigger so both ends of the stairs
+# can animate at the same time, and one for rain
+TRIGGER1_LAYER = 0
+TRIGGER2_LAYER = 1
+RAIN_LAYER = 2
+compositor = Compositor(output, channels.low, 3, ADD if CONFIG.get("blend") == "add" else MAX)
 
 
-def set_channel_value(index, value):
-    state["active_channels"][index] = value
-    if index < 16:
-        pca.duty(index, value)
+def update_state_idle_channels():
+    if state.on:
+        channels.update_low(animation.level_min, animation.edge_glow)
     else:
-        pwm0.duty_u16(16 * value)
-
-
-def get_channel_value(index):
-    return state["active_channels"][index]
+        channels.update_low(0, 0)
 
 
-animations = Animations(animation, state, set_channel_value, get_channel_value)
-
+def set_idle_levels():
+    # running layers stay on top, the idle levels under them change right away
+    update_state_idle_channels()
+    compositor.commit()
+
+
+# ticks_ms counts from reset, so this is boot to light
+set_idle_levels()
+boot_to_light_ms = time.ticks_ms()
+print("Boot to light:", boot_to_light_ms, "ms")
+
+import asyncio  # noqa: E402
+import gc  # noqa: E402
+from lib.animations import Animations, FRAME_MS  # noqa: E402
+from lib.framecache import FrameCache  # noqa: E402
+from lib.trigger import Trigger  # noqa: E402
+from lib.metrics import metrics  # noqa: E402
+from lib.state import IDLE, ANIMATE_IN, PAUSE, ANIMATE_OUT, OVERRIDE, PHASE_NAMES  # noqa: E402
+
+metrics.counter("boot_to_light_ms")
+metrics.set("boot_to_light_ms", boot_to_light_ms)
+
+# per trigger layer: phase state, the event that wakes its coordinator and the animations
+# rendering into it, trigger 1 is at the top so its animations run downwards
+layer_states = [AnimationState(), AnimationState()]
+layer_states[TRIGGER1_LAYER].forward = False
+layer_events = [asyncio.Event(), asyncio.Event()]
+
+# rendered sequences for replay, shared by the trigger layers, "frame_cache_bytes": 0 turns it off
+frame_cache_bytes = CONFIG.get("frame_cache_bytes", 16384)
+frame_cache = FrameCache(frame_cache_bytes) if frame_cache_bytes else None
+
+layer_animations = [
+    Animations(animation, layer_states[layer], channels, compositor.layers[layer], frame_cache)
+    for layer in (TRIGGER1_LAYER, TRIGGER2_LAYER)
+]
+
+# key -> [animate in, animate out, display name, easing in, easing out], see lib/easing.py,
+# effects are called on the layer's Animations, animating in eases out so there's a visible
+# change right after the trigger
 all_animations = {
-    "wave": [animations.wave_in, animations.wave_out, b"Wave"],
-    "breathe": [animations.breathe_in, animations.breathe_out, b"Breathe"],
+    "wave": [Animations.wave_in, Animations.wave_out, "Wave", "quad_out", "quad_in"],
+    "breathe": [Animations.breathe_in, Animations.breathe_out, "Breathe", "sine_out", "sine_in_out"],
     "breathe_wave": [
-        animations.breathe_in,
-        animations.wave_out,
-        b"Breathe In, Wave Out",
+        Animations.breathe_in,
+        Animations.wave_out,
+        "Breathe In, Wave Out",
+        "sine_out",
+        "quad_in",
     ],
     "wave_breathe": [
-        animations.wave_in,
-        animations.breathe_out,
-        b"Wave In, Breathe Out",
+        Animations.wave_in,
+        Animations.breathe_out,
+        "Wave In, Breathe Out",
+        "quad_out",
+        "sine_in_out",
     ],
 }
 
-# end animation config
-
-hass = Hass(state, animation, all_animations)
-
-
-def set_idle_brightness_cb(idle_brightness=0):
-    animation["level_min"] = min(max(idle_brightness, 0), animation["level_max"])
-    if animation["state"] == "idle":
-        set_idle_levels()
-    else:
-        update_state_idle_channels()
+# in case a stored effect got renamed
+if animation.effect not in all_animations:
+    animation.effect = "breathe"
 
+# end animation config
 
-hass.set_idle_brightness_cb(set_idle_brightness_cb)
+# loaded after the first frame, see start_hass()
+hass = None
+wifi = None
 
 
-def set_edge_glow_cb(edge_glow_level=0):
-    animation["edge_glow"] = min(max(edge_glow_level, 0), animation["level_max"])
-    if animation["state"] == "idle":
-        set_idle_levels()
-    else:
-        update_state_idle_channels()
+# was in boot, but it takes too long and it's more important to set up HW asap
+async def wifi_connect():
+    global wifi
+    from lib.wifi import WiFi
 
+    wifi = WiFi(CONFIG["ssid"], CONFIG["ssid_password"], CONFIG.get("static_ip"))
+    await wifi.connect()
+    # rejoins when the link drops
+    asyncio.create_task(wifi.supervise())
 
-hass.set_edge_glow_cb(set_edge_glow_cb)
 
+def invalidate_frame_cache():
+    # cached sequences are keyed by their levels, this only frees the ones that won't be used
+    if frame_cache is not None:
+        frame_cache.clear()
 
-def set_enabled_state_cb(enabled):
-    if state["on"] != enabled:
-        state["on"] = enabled
-        animation["state"] = "idle"
-        animation["animate_in"] = False
-        animation["animate_out"] = False
-        set_idle_levels()
 
+def set_idle_brightness_cb(idle_brightness=0):
+    animation.level_min = min(max(idle_brightness, 0), animation.level_max)
+    invalidate_frame_cache()
+    set_idle_levels()
 
-hass.set_enabled_state_cb(set_enabled_state_cb)
 
+def set_edge_glow_cb(edge_glow_level=0):
+    animation.edge_glow = min(max(edge_glow_level, 0), animation.level_max)
+    invalidate_frame_cache()
+    set_idle_levels()
 
-def set_idle_levels():
-    if not state["on"]:
-        for i in range(num_output_channels):
-            set_channel_value(i, 0)
-        return
 
-    update_state_idle_channels()
+def set_gamma_cb(gamma):
+    animation.gamma = gamma
+    asyncio.create_task(apply_gamma(gamma))
 
-    for i in range(num_output_channels):
-        set_channel_value(i, state["channels_low"][i])
 
+async def apply_gamma(gamma):
+    # the table is rebuilt in steps, the channels are sent out again once it's complete
+    if await gamma_table.rebuild(gamma):
+        output.table = gamma_table.table
+        output.restage()
+        output.commit()
 
-animation["pause_timer_ms"] = animation["pause_time"] * 1000
 
+def set_enabled_state_cb(enabled):
+    if state.on != enabled:
+        state.on = enabled
+        for layer in range(len(layer_states)):
+            layer_states[layer].phase = IDLE
+            layer_states[layer].animate_in = False
+            # let the coordinator drop out of the pause
+            layer_events[layer].set()
+        # every layer, rain included, so nothing stays blended over the off levels
+        for layer in range(len(compositor.layers)):
+            compositor.release(layer)
+        set_idle_levels()
+        settings.save()
 
-def should_terminate_out_anim():
-    return animation["state"] != "animate_out"
 
+def reset_pause_timer(layer_state):
+    layer_state.pause_until = time.ticks_add(time.ticks_ms(), animation.pause_time * 1000)
 
-def reset_pause_timer(animation):
-    animation["pause_timer_ms"] = animation["pause_time"] * 1000
 
+def start_animating(layer):
+    metrics.incr("triggers")
+    layer_state = layer_states[layer]
+    reset_pause_timer(layer_state)
+    if layer_state.phase == IDLE or layer_state.phase == ANIMATE_OUT:
+        layer_state.animate_in = True
+        # trigger to first frame latency
+        metrics.trigger()
 
-def start_animating(animation, direction="forward"):
-    reset_pause_timer(animation)
-    if animation["state"] == "idle" or animation["state"] == "animate_out":
-        animation["direction"] = direction
-        animation["animate_in"] = True
-        animation["animate_out"] = False
+    if layer_state.phase == ANIMATE_OUT:
+        layer_state.phase = OVERRIDE
 
-    if animation["state"] == "animate_out":
-        animation["state"] = "override"
+    layer_events[layer].set()
 
 
 def handle_trigger1_fire():
     print("Trigger 1 fired")
-    if state["on"]:
-        start_animating(animation, "reversed")
+    if state.on:
+        start_animating(TRIGGER1_LAYER)
     return True
 
 
 def handle_trigger2_fire():
     print("Trigger 2 fired")
-    if state["on"]:
-        start_animating(animation, "forward")
+    if state.on:
+        start_animating(TRIGGER2_LAYER)
     return True
 
 
@@ -221,7 +259,7 @@ async def blink_led(led_pin):
             continue
 
 
-        if not state["on"]:
+        if not state.on:
             await asyncio.sleep_ms(600)
             led_pin.on()
             await asyncio.sleep_ms(100)
@@ -236,72 +274,105 @@ async def blink_led(led_pin):
         await asyncio.sleep_ms(1000)
 
 
-async def check_state(animation):
-    interval_ms = 500
-    while True:
-        print(
-            "state:",
-            "On" if state["on"] else "Off",
-            "animation state:",
-            animation["state"],
-        )
-        if animation["state"] == "pause":
-            animation["pause_timer_ms"] -= interval_ms
-            if animation["pause_timer_ms"] <= 0:
-                reset_pause_timer(animation)
-                animation["animate_out"] = True
-        await asyncio.sleep_ms(interval_ms)
-
-
-async def run_animation_in(animation):
-    while True:
-        if (
-            state["on"]
-            and animation["animate_in"]
-            and (animation["state"] == "idle" or animation["state"] == "override")
-        ):
-            print("run_animation_in")
-            animation["state"] = "animate_in"
-            animation["animate_in"] = False
-            await all_animations[animation["effect"]][0]()
-            animation["state"] = "pause"
-        else:
-            await asyncio.sleep_ms(100)
+async def pause(layer_state, event):
+    # sleep until the pause deadline, triggers in the meantime push the deadline back
+    reset_pause_timer(layer_state)
+    while layer_state.phase == PAUSE:
+        remaining = time.ticks_diff(layer_state.pause_until, time.ticks_ms())
+        if remaining <= 0:
+            return
+        event.clear()
+        try:
+            await asyncio.wait_for_ms(event.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
 
 
-async def run_animation_out(animation):
-    while True:
-        if state["on"] and animation["animate_out"] and animation["state"] == "pause":
-            print("run_animation_out")
-            animation["animate_out"] = False
-            animation["state"] = "animate_out"
-            await all_animations[animation["effect"]][1]()
-            animation["state"] = "idle"
-        else:
-            await asyncio.sleep_ms(100)
+def set_phase(layer, phase):
+    print("animation state", layer, ":", PHASE_NAMES[phase])
+    layer_states[layer].phase = phase
 
 
-async def check_mqtt_msg():
+async def run_animations(layer):
+    # one coordinator per trigger layer: idle -> animate_in -> pause -> animate_out -> idle
+    # a trigger during animate_out sets OVERRIDE, which goes straight back to animate_in
+    layer_state = layer_states[layer]
+    event = layer_events[layer]
+    animations = layer_animations[layer]
     while True:
-        hass.check_msg()
-        await asyncio.sleep_ms(500)
+        if not (state.on and layer_state.animate_in):
+            event.clear()
+            await event.wait()
+            continue
+
+        set_phase(layer, ANIMATE_IN)
+        layer_state.animate_in = False
+        compositor.activate(layer)
+        effect = all_animations[animation.effect]
+        await effect[0](animations, effect[3])
+        print("output writes:", output.stats())
+        # disabled while animating
+        if layer_state.phase != ANIMATE_IN:
+            continue
+
+        set_phase(layer, PAUSE)
+        await pause(layer_state, event)
+        if layer_state.phase != PAUSE:
+            continue
+
+        set_phase(layer, ANIMATE_OUT)
+        effect = all_animations[animation.effect]
+        await effect[1](animations, effect[4])
+        print("output writes:", output.stats())
+        if layer_state.phase == ANIMATE_OUT:
+            set_phase(layer, IDLE)
+            compositor.release(layer)
+            compositor.commit()
+
+
+async def run_rain():
+    compositor.activate(RAIN_LAYER)
+    await Animations(animation, AnimationState(), channels, compositor.layers[RAIN_LAYER]).rain()
+
+
+def start_hass():
+    global hass
+    from lib.hass import Hass
+
+    hass = Hass(state, animation, all_animations, CONFIG)
+    hass.set_idle_brightness_cb(set_idle_brightness_cb)
+    hass.set_edge_glow_cb(set_edge_glow_cb)
+    hass.set_gamma_cb(set_gamma_cb)
+    hass.set_animation_changed_cb(invalidate_frame_cache)
+    hass.set_enabled_state_cb(set_enabled_state_cb)
+    hass.set_changed_cb(settings.save)
+    hass.connect()
 
 
 async def my_app():
     # let me know you're alive LED
     asyncio.create_task(blink_led(led_pin))
 
-    set_idle_levels()
+    # the first frame went out linear, switch to the stored curve
+    asyncio.create_task(apply_gamma(animation.gamma))
 
-    # animation tasks
-    asyncio.create_task(check_state(animation))
-    asyncio.create_task(run_animation_in(animation))
-    asyncio.create_task(run_animation_out(animation))
+    # one composite per frame period for all animating layers
+    asyncio.create_task(compositor.run(FRAME_MS))
+
+    # animation coordinators, one per trigger
+    asyncio.create_task(run_animations(TRIGGER1_LAYER))
+    asyncio.create_task(run_animations(TRIGGER2_LAYER))
+
+    # event loop lag and heap low-water mark
+    asyncio.create_task(metrics.monitor())
+
+    # coalesced settings writes to flash
+    asyncio.create_task(settings.run())
 
     # Trigger handlers
-    trigger1 = Pushbutton(trigger1_pin)
+    trigger1 = Trigger(trigger1_pin)
     trigger1.press_func(handle_trigger1_fire)
-    trigger2 = Pushbutton(trigger2_pin)
+    trigger2 = Trigger(trigger2_pin)
     trigger2.press_func(handle_trigger2_fire)
 
     await wifi_connect()
@@ -309,17 +380,18 @@ async def my_app():
     gc.collect()
 
     # Home Asistant stuff
-    hass.connect()
-    asyncio.create_task(check_mqtt_msg())
+    start_hass()
 
-    # asyncio.create_task(animations.rain())
+    # asyncio.create_task(run_rain())
 
     # run forever
     while True:
         await asyncio.sleep(1)
 
 
-try:
-    asyncio.run(my_app())
-finally:
-    asyncio.new_event_loop()  # Clear retained state
+# main.py runs as __main__ on the device, the host benchmarks import it instead
+if __name__ == "__main__":
+    try:
+        asyncio.run(my_app())
+    finally:
+        asyncio.new_event_loop()  # Clear retained state
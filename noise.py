@@ -1,36 +1,105 @@
 # used to generate data for rain animation
 # from noise import Noise
-# noise = Noise().get(channels=17, steps=200)
-# then paste into animations.py as static data
+# Noise(seed=1).save("rain.bin", channels=17, steps=200, loop=True)
+# or: python noise.py rain.bin --channels 17 --steps 200 --seed 1 --loop
+# then upload rain.bin next to main.py, lib/rain.py streams it from flash
 
-from perlin_noise import PerlinNoise
+import argparse
+from struct import pack
+
+import numpy as np
+
+# packed frame file header, see lib/rain.py
+HEADER = "<2sBBHH"
+
+# (frequency, amplitude) of the summed noise layers
+OCTAVES = ((3, 1.0), (6, 0.5), (12, 0.25), (24, 0.125))
+
+
+def pack_sequence(sequence, bits=12):
+    # (steps x channels) values in 0..4095 -> packed frame file contents
+    values = np.asarray(sequence, dtype=np.uint16)
+    steps, channels = values.shape
+    header = pack(HEADER, b"NZ", bits, channels, steps, 0)
+    if bits == 8:
+        return header + (values >> 4).astype(np.uint8).tobytes()
+    # two 12 bit values per three bytes, odd channel count leaves half a byte of padding
+    if channels % 2:
+        values = np.pad(values, ((0, 0), (0, 1)))
+    a = values[:, 0::2]
+    b = values[:, 1::2]
+    packed = np.stack((a & 0xFF, (a >> 8) | ((b & 0x0F) << 4), b >> 4), axis=-1).astype(np.uint8)
+    row_size = (channels * 3 + 1) // 2
+    return header + np.ascontiguousarray(packed.reshape(steps, -1)[:, :row_size]).tobytes()
+
+
+def _fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def perlin(steps, channels, frequency, rng, loop=False):
+    # 2D gradient noise on a (steps x channels) grid spanning `frequency` lattice cells per axis,
+    # with loop the lattice wraps along steps so the last row flows into the first
+    x = np.arange(steps) * (frequency / steps)
+    y = np.arange(channels) * (frequency / channels)
+    angles = rng.uniform(0, 2 * np.pi, (frequency + 1, frequency + 1))
+    grad_x = np.cos(angles)
+    grad_y = np.sin(angles)
+
+    x0 = np.floor(x).astype(np.intp)
+    y0 = np.floor(y).astype(np.intp)
+    fx = (x - x0)[:, None]
+    fy = (y - y0)[None, :]
+    x1 = x0 + 1
+    if loop:
+        x0 %= frequency
+        x1 %= frequency
+    x0 = x0[:, None]
+    x1 = x1[:, None]
+    y1 = (y0 + 1)[None, :]
+    y0 = y0[None, :]
+
+    def corner(ix, iy, dx, dy):
+        return grad_x[ix, iy] * dx + grad_y[ix, iy] * dy
+
+    u = _fade(fx)
+    v = _fade(fy)
+    top = corner(x0, y0, fx, fy) * (1 - u) + corner(x1, y0, fx - 1, fy) * u
+    bottom = corner(x0, y1, fx, fy - 1) * (1 - u) + corner(x1, y1, fx - 1, fy - 1) * u
+    return top * (1 - v) + bottom * v
 
 
 class Noise():
-    def get(self, channels = 10, steps = 100):
-        noise1 = PerlinNoise(octaves=3)
-        noise2 = PerlinNoise(octaves=6)
-        noise3 = PerlinNoise(octaves=12)
-        noise4 = PerlinNoise(octaves=24)
-
-        xpix, ypix = steps, channels
-        sequence = []
-        for i in range(xpix):
-            row = []
-            for j in range(ypix):
-                noise_val = noise1([i/xpix, j/ypix])
-                noise_val += 0.5 * noise2([i/xpix, j/ypix])
-                noise_val += 0.25 * noise3([i/xpix, j/ypix])
-                noise_val += 0.125 * noise4([i/xpix, j/ypix])
-
-                row.append(noise_val)
-            sequence.append(row)
-
-        # print min and max values across all rows of sequence
-        min_val = min([min(row) for row in sequence])
-        max_val = max([max(row) for row in sequence])
+    def __init__(self, seed = None):
+        self.seed = seed
+
+    def field(self, channels = 10, steps = 100, loop = False):
+        rng = np.random.default_rng(self.seed)
+        sequence = np.zeros((steps, channels))
+        for frequency, amplitude in OCTAVES:
+            sequence += amplitude * perlin(steps, channels, frequency, rng, loop)
+
+        min_val = sequence.min()
+        max_val = sequence.max()
         print(min_val, max_val)
-        # scale entire sequence to [0, 255]
-        sequence = [[int((val - min_val) / (max_val - min_val) * 4095) for val in row] for row in sequence]
+        # scale entire sequence to [0, 4095]
+        return ((sequence - min_val) * (4095 / (max_val - min_val))).astype(np.uint16)
+
+    def get(self, channels = 10, steps = 100, loop = False):
+        return self.field(channels, steps, loop).tolist()
+
+    def save(self, path, channels = 17, steps = 200, bits = 12, loop = False):
+        with open(path, "wb") as f:
+            f.write(pack_sequence(self.field(channels, steps, loop), bits))
+
 
-        return sequence
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a packed noise sequence for the rain animation")
+    parser.add_argument("path")
+    parser.add_argument("--channels", type=int, default=17)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--bits", type=int, choices=(8, 12), default=12)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--loop", action="store_true", help="make the last row flow into the first")
+    args = parser.parse_args()
+    Noise(args.seed).save(args.path, args.channels, args.steps, args.bits, args.loop)
@@ -0,0 +1,48 @@
+# Precompiles the firmware modules to .mpy so the device skips compiling them on boot:
+#   python tools/build.py [--mpy-cross mpy-cross] [--out build]
+# build/ then mirrors the source tree with lib/**/*.mpy, main.py and boot.py stay source
+# (MicroPython only runs them as .py), upload build/ instead of the repo.
+# To freeze the modules into the firmware instead, use tools/manifest.py.
+
+import argparse
+import os
+import shutil
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# kept as source
+SOURCE_FILES = ("main.py", "boot.py")
+# copied as is if present
+DATA_FILES = ("config.json", "rain.bin")
+
+
+def build(mpy_cross, out_dir):
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    lib_dir = os.path.join(ROOT_DIR, "lib")
+    compiled = 0
+    for dirpath, _, filenames in os.walk(lib_dir):
+        for filename in sorted(filenames):
+            if not filename.endswith(".py"):
+                continue
+            src = os.path.join(dirpath, filename)
+            rel = os.path.relpath(src, ROOT_DIR)
+            dst = os.path.join(out_dir, rel[:-3] + ".mpy")
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            # -s keeps the source name in tracebacks short
+            subprocess.run([mpy_cross, "-s", rel, "-o", dst, src], check=True)
+            compiled += 1
+    for name in SOURCE_FILES + DATA_FILES:
+        src = os.path.join(ROOT_DIR, name)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(out_dir, name))
+    print("compiled", compiled, "modules into", out_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="precompile firmware modules to .mpy")
+    parser.add_argument("--mpy-cross", default="mpy-cross")
+    parser.add_argument("--out", default=os.path.join(ROOT_DIR, "build"))
+    args = parser.parse_args()
+    build(args.mpy_cross, args.out)
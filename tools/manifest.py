@@ -0,0 +1,6 @@
+# Freezes the firmware modules into a custom MicroPython build, from the port directory:
+#   make BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/esp8266-stairs/tools/manifest.py
+# main.py and boot.py stay on the filesystem.
+
+include("$(PORT_DIR)/boards/manifest.py")
+package("lib", base_path="..")